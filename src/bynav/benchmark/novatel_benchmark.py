@@ -0,0 +1,42 @@
+"""
+NovatelParser的吞吐量基准测试
+
+用test_novatel中的合成数据流(ASCII/二进制IMU, 姿态, gps和乱码)按随机长度分块输入,
+输出每秒解析的消息数, 应远高于IMU输出频率(200Hz).
+
+    python3 novatel_benchmark.py -n 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, ".."))
+sys.path.append(os.path.join(BASE_DIR, "..", "test"))
+
+from bynav.novatel import NovatelParser
+from test_novatel import recording, replay
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description="NovatelParser吞吐量")
+    parser.add_argument("-n", "--samples", type=int, default=20000, help="IMU采样组数")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args(args)
+
+    data = recording(args.samples)
+    best = None
+    for _ in range(args.repeat):
+        novatel = NovatelParser()
+        t0 = time.perf_counter()
+        messages = replay(novatel, data)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("%d条消息, %.1fMB, %.3fs, %.0f条/s, %.1fMB/s" % (
+        len(messages), len(data) / 2**20, best, len(messages) / best, len(data) / 2**20 / best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+LOAM各环节的基准测试
+
+用合成的RS16帧(或录制的rosbag2/pcap)分别测试read_points, label, FeatureExtraction.process,
+LEGO_cloudhandler, LidarOdometry.matching, NewtonGussian, LevenbergMarquardt和Map.output,
+输出每帧耗时的分位数, 吞吐量和峰值内存, 写入JSON以便不同提交之间比较.
+
+    python3 run_benchmark.py -n 50 -o benchmark.json
+    python3 run_benchmark.py --bag path/to/bag -o benchmark.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, "..", "bynav"))
+
+from LOAM import FeatureExtraction, LEGO_cloudhandler, LidarMapping, LidarOdometry, Map, ScanFrame
+from decoder import PointCloudDecoder
+
+
+def synthetic_frames(n, seed=0):
+    """合成的RS16帧: 20m*16m*5.5m的房间, 传感器每帧前进0.1m并转0.5度, 距离加1cm噪声"""
+    rng = np.random.default_rng(seed)
+    i = np.arange(28800)
+    laser = i % 16
+    ring = np.where(laser < 9, laser, 24 - laser)
+    elevation = np.radians(-15 + 2 * ring)
+    azimuth = np.radians(i // 16 * 0.2)
+    planes = [(0, 10), (0, -10), (1, 8), (1, -8), (2, -1.5), (2, 4)]
+
+    for k in range(n):
+        yaw = np.radians(0.5 * k)
+        origin = np.array([0.1 * k - 2.0, 0.0, 0.0])
+        d = np.stack((np.cos(elevation) * np.cos(azimuth + yaw), np.cos(elevation) * np.sin(azimuth + yaw), np.sin(elevation)), axis=1)
+        with np.errstate(divide='ignore'):
+            t = np.min([np.where((b - origin[axis]) / d[:, axis] > 0, (b - origin[axis]) / d[:, axis], np.inf) for axis, b in planes], axis=0)
+        t += rng.normal(0, 0.01, t.shape)
+        p = d * t[:, np.newaxis]
+        c, s = np.cos(-yaw), np.sin(-yaw)
+        p = p @ np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]]).T
+
+        yield k * 0.1, to_cloud(p.astype(np.float32))
+
+
+def to_cloud(xyz):
+    """n*3坐标打包为PointCloud2格式(x, y, z, intensity)的消息"""
+    data = np.zeros((xyz.shape[0], 4), dtype=np.float32)
+    data[:, :3] = xyz
+    fields = [SimpleNamespace(name=name, offset=4 * k, datatype=7, count=1) for k, name in enumerate("xyz") ]
+    fields.append(SimpleNamespace(name="intensity", offset=12, datatype=7, count=1))
+
+    return SimpleNamespace(height=1, width=xyz.shape[0], point_step=16, row_step=16 * xyz.shape[0],
+                           is_bigendian=False, fields=fields, data=data.tobytes())
+
+
+def recorded_frames(path, n, topic, lidar_type):
+    """录制数据(rosbag2或pcap)的前n帧, 需要ROS环境"""
+    import offline
+    if path.endswith(".pcap"):
+        frames = offline.read_pcap(path, lidar_type=lidar_type)
+    else:
+        frames = offline.read_bag(path, topic, lidar_type)
+    for k, (stamp, (xyz, _, _, _)) in enumerate(frames):
+        if k >= n:
+            break
+        yield stamp, to_cloud(np.ascontiguousarray(xyz, dtype=np.float32))
+
+
+class Recorder():
+    """记录每个环节每帧的耗时和峰值内存"""
+    def __init__(self):
+        self.latency = {}
+        self.memory = {}
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] - base
+        self.latency.setdefault(name, []).append(elapsed)
+        self.memory[name] = max(self.memory.get(name, 0), peak)
+
+    def summary(self):
+        result = {}
+        for name, latency in self.latency.items():
+            latency = np.array(latency) * 1000
+            result[name] = {
+                "frames": int(latency.shape[0]),
+                "mean_ms": float(latency.mean()),
+                "p50_ms": float(np.percentile(latency, 50)),
+                "p90_ms": float(np.percentile(latency, 90)),
+                "p99_ms": float(np.percentile(latency, 99)),
+                "max_ms": float(latency.max()),
+                "throughput_fps": float(1000 / latency.mean()) if latency.mean() > 0 else 0.0,
+                "peak_memory_mb": self.memory[name] / 2**20,
+            }
+
+        return result
+
+
+def run(frames, warmup=2):
+    """逐帧运行各环节, 前warmup帧不计入"""
+    recorder = Recorder()
+    decoder = PointCloudDecoder("RS16")
+    feature_extraction = FeatureExtraction()
+    cloudhandler = LEGO_cloudhandler()
+    odometry_gn = LidarOdometry(solver="GN")
+    odometry_lm = LidarOdometry(solver="LM")
+    mapping = LidarMapping()
+    map = Map()
+    scan = ScanFrame()
+    last_features = None
+
+    tracemalloc.start()
+    for k, (stamp, cloud) in enumerate(frames):
+        if k == warmup:
+            recorder = Recorder()
+
+        with recorder.measure("read_points"):
+            xyz = decoder.read_points(cloud)
+        with recorder.measure("label"):
+            ring, column = decoder.label(xyz)
+        scan.load(xyz, ring, column)
+
+        with recorder.measure("LEGO_cloudhandler"):
+            _, ground = cloudhandler.markground(scan)
+            cloudhandler.cloudsegmentation(scan, ground)
+
+        with recorder.measure("FeatureExtraction.process"):
+            feature_extraction.process(scan)
+        features = feature_extraction.features
+
+        if last_features is not None:
+            odometry_gn.set_last_features(last_features)
+            odometry_lm.set_last_features(last_features)
+            with recorder.measure("LidarOdometry.matching"):
+                odometry_gn.matching(features, np.zeros(6))
+            odometry_gn.set_last_features(last_features)   #清空matching留下的对应关系缓存
+            with recorder.measure("NewtonGussian"):
+                odometry_gn.NewtonGussian(features)
+            with recorder.measure("LevenbergMarquardt"):
+                odometry_lm.LevenbergMarquardt(features)
+
+        pose = mapping.add_odometry(odometry_lm.T_last if last_features is not None else None, stamp)
+        with recorder.measure("Map.output"):
+            map.output(scan.take(slice(None)), pose)
+        last_features = features
+    tracemalloc.stop()
+
+    return recorder.summary()
+
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description="LOAM基准测试")
+    parser.add_argument("-n", "--frames", type=int, default=30)
+    parser.add_argument("-o", "--output", default="benchmark.json")
+    parser.add_argument("--bag", help="录制的rosbag2(.db3或目录)或.pcap, 不给出时用合成帧")
+    parser.add_argument("--topic", default="/rslidar_points")
+    args = parser.parse_args(args)
+
+    if args.bag:
+        frames = recorded_frames(args.bag, args.frames, args.topic, "RS16")
+    else:
+        frames = synthetic_frames(args.frames)
+    results = run(frames)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    report = {
+        "commit": commit,
+        "source": args.bag or "synthetic",
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        print("%-28s p50 %8.2fms  p99 %8.2fms  %7.1f帧/s  %7.1fMB" % (
+            name, result["p50_ms"], result["p99_ms"], result["throughput_fps"], result["peak_memory_mb"]))
+
+
+if __name__ == "__main__":
+    main()
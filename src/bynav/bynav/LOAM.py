@@ -1,203 +1,613 @@
 import math
 from os import scandir
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.linalg import cho_factor, cho_solve
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 from math import *
 import time
 
+import sys,os
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+
+from decoder import get_layout
+from filters import crop_box, voxel_downsample, voxel_keys
+from lie import euler_to_matrix, rotate_points, so3_log, transform_points
+
 
 class LOAM():
     """
     LOAM算法主程序
     """
-    def __init__(self):
-        self.feature_extraction = FeatureExtraction()
+    def __init__(self, lidar_type="RS16", deskew=True):
+        self.feature_extraction = FeatureExtraction(lidar_type=lidar_type)
         self.lidar_odometry = LidarOdometry()
+        self.lidar_mapping = LidarMapping()
         self.map = Map()
+        self.deskew = Deskew()
+        self.deskew_enabled = deskew    #input中是否做运动畸变校正
+
+    def input(self, data, rate=None, T0=None, stamp=None):
+        """data为ScanFrame或n*5数组, rate为扫描期间的角速度(rad/s, 可选), T0为里程计初值(可选), stamp为帧时间(可选)
+
+        返回该帧的里程计位姿(4*4), 全局位姿为lidar_mapping.pose(里程计位姿).
+        """
+        if not isinstance(data, ScanFrame):
+            data = self.feature_extraction.scan.load_array(data)
+        if self.deskew_enabled:
+            self.deskew.process(data, self.lidar_odometry.T_last, rate)
 
-    def input(self, data):
         self.feature_extraction.process(data)
-        self.lidar_odometry.process(self.feature_extraction.features)
+        self.lidar_odometry.process(self.feature_extraction.features, T0)
+        odom_pose, _ = self.odometry_to_mapping(self.feature_extraction.features, stamp=stamp)
+
+        return odom_pose
+
+    def odometry_to_mapping(self, features, sync=True, stamp=None):
+        """累积里程计位姿并判断是否建图
+
+        sync为True时同步建图; 否则由调用方在其他线程调用lidar_mapping.process.
+        返回该帧里程计位姿和是否需要建图.
+        """
+        T = self.lidar_odometry.T_last if self.lidar_mapping.frame_count > 0 else None
+        odom_pose = self.lidar_mapping.add_odometry(T, stamp)
+        due = self.lidar_mapping.due()
+        if due and sync:
+            self.lidar_mapping.process(features, odom_pose)
+
+        return odom_pose, due
     
     def output(self, pcn):
-        pcn = pcn[:,:3]
-        pcn = self.lidar_odometry.transform(pcn, self.lidar_odometry.T) #通过T（有R，t的属性），使点（我们用特征点）做变换
+        """pcn为输入LOAM的同一帧点云(ScanFrame或数组), 流水线中特征提取可能已处理到下一帧"""
+        if isinstance(pcn, ScanFrame):
+            pcn = pcn.points
+        #pcn = self.lidar_odometry.transform(pcn[:,:3], self.lidar_odometry.T) #通过T（有R，t的属性），使点（我们用特征点）做变换
         #pcn = self.map.input(self.feature_extraction.features)
         #pcn = self.map.process(self.feature_extraction.features)
-        pcn = self.map.limit(self.feature_extraction.allpiont,-20,20,-20,20,-20,20)
-        T_list = self.lidar_odometry.T_list
-        #pcn = self.map.output(self.feature_extraction.allpiont, T_list)
-        print(pcn.shape)
+        pcn = self.map.limit(pcn,-20,20,-20,20,-20,20)
+        #pcn = self.map.output(self.feature_extraction.allpiont, self.lidar_mapping.trajectory.latest)
         #pcn = self.feature_extraction.ground_point
         return pcn
 
 
+class ScanFrame():
+    """
+    一帧点云的结构数组: float32坐标, uint8线号, uint16列号, float32相对时间
+
+    缓冲区按容量预分配, 载入新帧时复用; points/rings/columns/times为当前帧的视图,
+    取子集时只用索引或掩码, 不复制整帧.
+    """
+    def __init__(self, capacity=28800):
+        self.xyz = np.zeros((capacity, 3), dtype=np.float32)
+        self.ring = np.zeros(capacity, dtype=np.uint8)
+        self.column = np.zeros(capacity, dtype=np.uint16)
+        self.time = np.zeros(capacity, dtype=np.float32)
+        self.size = 0
+
+    def load(self, xyz, ring, column, time=None):
+        """载入一帧, 容量不足时扩容
+
+        time为各点在扫描周期内的相对时间(0为帧首, 1为帧尾), 未给出时按列号计算.
+        """
+        n = xyz.shape[0]
+        if n > self.xyz.shape[0]:
+            self.__init__(n)
+        self.size = n
+        self.xyz[:n] = xyz
+        self.ring[:n] = ring
+        self.column[:n] = column
+        if time is not None:
+            self.time[:n] = time
+        elif n > 0:
+            np.divide(self.column[:n], max(int(self.column[:n].max()), 1), out=self.time[:n])
+
+        return self
+
+    def load_array(self, pcn):
+        """载入n*5数组(坐标, 线号, 列号)"""
+        return self.load(pcn[:, :3], pcn[:, 3], pcn[:, 4])
+
+    @property
+    def points(self):
+        return self.xyz[:self.size]
+
+    @property
+    def rings(self):
+        return self.ring[:self.size]
+
+    @property
+    def columns(self):
+        return self.column[:self.size]
+
+    @property
+    def times(self):
+        return self.time[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def take(self, index):
+        """按索引或布尔掩码取子集, 返回n*5的float64数组(坐标, 线号, 列号), 用于特征点等小子集"""
+        points = self.points[index]
+        out = np.empty((points.shape[0], 5))
+        out[:, :3] = points
+        out[:, 3] = self.rings[index]
+        out[:, 4] = self.columns[index]
+
+        return out
+
+
+class Trajectory():
+    """
+    按时间递增存放每帧的累积位姿(4*4), 预分配, 容量不足时翻倍
+
+    每帧只与上一帧的累积位姿复合一次, 任一帧的位姿可按帧号或时间直接取出,
+    不需要从头重放帧间变换.
+    """
+    def __init__(self, capacity=1000):
+        self.stamp = np.zeros(capacity)
+        self.pose = np.zeros((capacity, 4, 4))
+        self.size = 0
+
+    def append(self, T=None, stamp=None):
+        """追加一帧, T为相对上一帧的4*4变换(首帧为None即单位阵), stamp默认为帧号, 返回该帧位姿"""
+        n = self.size
+        if n == self.pose.shape[0]:
+            self.stamp = np.concatenate((self.stamp, np.zeros(n)))
+            self.pose = np.concatenate((self.pose, np.zeros((n, 4, 4))))
+
+        if n == 0 or T is None:
+            self.pose[n] = self.pose[n - 1] if n > 0 else np.eye(4)
+        else:
+            np.matmul(self.pose[n - 1], T, out=self.pose[n])
+        self.stamp[n] = n if stamp is None else stamp
+        self.size = n + 1
+
+        return self.pose[n].copy()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        """按帧号取位姿, 支持负数和切片"""
+        return self.pose[:self.size][index]
+
+    @property
+    def latest(self):
+        return self.pose[self.size - 1] if self.size > 0 else np.eye(4)
+
+    @property
+    def stamps(self):
+        return self.stamp[:self.size]
+
+    def lookup(self, stamp):
+        """时间不晚于stamp的最近一帧的位姿, 早于首帧时返回首帧"""
+        index = np.searchsorted(self.stamps, stamp, side="right") - 1
+
+        return self.pose[np.clip(index, 0, max(self.size - 1, 0))]
+
+
+class RingIndex():
+    """
+    按线号(第4列)分组, 组内按方位角排序的特征点索引
+
+    排序键为线号*8+方位角(方位角范围小于8), 查找某条线上离查询点最近的点时,
+    对排序键做一次批量searchsorted, 在方位角相邻的几个候选(含首尾, 处理0/2pi处的接缝)
+    中取三维距离最近的一个.
+    """
+    def __init__(self, points):
+        self.points = points[:, :3]
+        ring = np.rint(points[:, 3]).astype(int)
+        azimuth = np.arctan2(points[:, 1], points[:, 0]) + np.pi
+        self.order = np.lexsort((azimuth, ring))
+        self.key = ring[self.order] * 8 + azimuth[self.order]
+        self.rings = int(ring.max()) + 1 if ring.shape[0] else 0
+        self.start = np.searchsorted(ring[self.order], np.arange(self.rings + 1))
+
+    def query(self, xyz, ring, exclude=None, max_distance=np.inf):
+        """xyz(m*3)在各自ring线上的最近点的原索引, exclude为要排除的原索引, 找不到或远于max_distance时为-1"""
+        ring = np.asarray(ring, dtype=int)
+        if self.order.shape[0] == 0:
+            return np.full(ring.shape[0], -1)
+
+        valid = (ring >= 0) & (ring < self.rings)
+        ring = np.clip(ring, 0, max(self.rings - 1, 0))
+        start, end = self.start[ring], self.start[ring + 1]
+        pos = np.searchsorted(self.key, ring * 8 + np.arctan2(xyz[:, 1], xyz[:, 0]) + np.pi)
+
+        candidate = np.stack((pos - 2, pos - 1, pos, pos + 1, start, end - 1), axis=1)
+        candidate = np.clip(candidate, start[:, np.newaxis], np.maximum(end - 1, start)[:, np.newaxis])
+        index = self.order[np.minimum(candidate, self.order.shape[0] - 1)]
+        distance = np.linalg.norm(self.points[index] - xyz[:, np.newaxis, :3], axis=2)
+        distance[~valid | (end <= start)] = np.inf
+        distance[distance > max_distance] = np.inf
+        if exclude is not None:
+            distance[index == np.asarray(exclude)[:, np.newaxis]] = np.inf
+
+        best = np.argmin(distance, axis=1)
+        rows = np.arange(best.shape[0])
+        result = index[rows, best]
+        result[np.isinf(distance[rows, best])] = -1
+
+        return result
+
+    def query_adjacent(self, xyz, ring, max_distance=np.inf):
+        """相邻两条线(ring-1, ring+1)上离xyz最近的点的原索引, 找不到或远于max_distance时为-1"""
+        ring = np.asarray(ring, dtype=int)
+        lower, upper = self.query(xyz, ring - 1, max_distance=max_distance), self.query(xyz, ring + 1, max_distance=max_distance)
+        d_lower = np.where(lower >= 0, np.linalg.norm(self.points[lower] - xyz[:, :3], axis=1), np.inf)
+        d_upper = np.where(upper >= 0, np.linalg.norm(self.points[upper] - xyz[:, :3], axis=1), np.inf)
+
+        return np.where(d_lower <= d_upper, lower, upper)
+
+
+class Deskew():
+    """
+    运动畸变校正, 把一帧中各点变换到帧尾时刻的坐标系
+
+    假设扫描期间匀速运动: 帧首到帧尾的运动取上一帧的里程计结果T(或由角速度积分的旋转),
+    相对时间为s的点乘以该运动的(s-1)倍. 旋转按固定转轴的Rodrigues公式整帧批量计算.
+    """
+    def __init__(self, period=0.1):
+        self.period = period    #扫描周期(s)
+
+    def process(self, scan, T=None, rate=None):
+        """原地校正ScanFrame, rate为角速度(rad/s, 激光雷达坐标系), 给出时代替T中的旋转"""
+        if (T is None and rate is None) or len(scan) == 0:
+            return scan
+
+        if rate is not None:
+            rotvec = np.asarray(rate, dtype=float) * self.period
+        else:
+            rotvec = so3_log(euler_to_matrix(T)[:3, :3])
+        t = np.zeros(3) if T is None else np.asarray(T[3:6], dtype=float)
+
+        p = scan.points
+        s = (scan.times - 1)[:, np.newaxis]
+        p[:] = rotate_points(s * rotvec.astype(np.float32), p) + s * t.astype(np.float32)
+
+        return scan
+
+
 class FeatureExtraction():
     """
     LOAM算法提取特征
     """
-    def __init__(self):
+    def __init__(self, edge_num=100, plane_num=100, nms_window=5, edge_curv_max=100, plane_curv_min=0, ground_removal=True, segmentation=True, lidar_type="RS16"):
         self.edge_points = []
         self.plane_points = []
         self.features = []
         self.edge_points_index = []
         self.plane_points_index = []
         
-        self.LEGO_cloudhandler = LEGO_cloudhandler()
+        self.rings = get_layout(lidar_type)[0]  #每列点数, 同一线上相邻两点的步长
+        self.LEGO_cloudhandler = LEGO_cloudhandler(lidar_type)
         self.allpiont = []
+        self.scan = ScanFrame()     #输入为数组时复用的帧缓冲
+
+        """特征点选取参数(精准度&速度), 可在运行时修改"""
+        self.edge_num = edge_num            #每个扇区最多边缘点数
+        self.plane_num = plane_num          #每个扇区最多平面点数
+        self.nms_window = nms_window        #非极大值抑制窗口, 与前后nms_window-1个点比较
+        self.edge_curv_max = edge_curv_max  #边缘点曲率上限
+        self.plane_curv_min = plane_curv_min  #平面点曲率下限
+        self.ground_removal = ground_removal  #True: 按坡度分割地面点; False: 去掉每列最下面4线
+        self.segmentation = segmentation      #True: 去除少于30个点的聚类(需第3, 4列为线号, 列号)
     
     def process(self, pcn):
+        """pcn为ScanFrame或n*5数组(坐标, 线号, 列号)"""
+        if not isinstance(pcn, ScanFrame):
+            pcn = self.scan.load_array(pcn)
         self.allpiont = pcn
-        self.processed_pcn = []
         self.edge_points = []
         self.plane_points = []
         self.edge_points_index = []
         self.plane_points_index = []
 
         """分割地面点"""
-        #pcn = self.LEGO_cloudhandler.pointcloudproject(pcn)
-        #pcn,self.ground_point_index = self.LEGO_cloudhandler.markground(pcn)
-        #self.ground_point = pcn[self.ground_point_index, :]
+        if self.ground_removal:
+            pcn, ground = self.LEGO_cloudhandler.markground(pcn)
+            self.ground_point = pcn.take(ground)
+            processed_index = None
+            exclude = ground
+            step = self.rings
+        else:
+            ground = None
+            processed_index = np.flatnonzero(np.arange(len(pcn)) % self.rings >= 4)
+            exclude = None
+            step = self.rings - 4
 
-        """分割地面点"""
-        for i in range(pcn.shape[0]):
-            if i % 16 >= 4:
-                self.processed_pcn.append(pcn[i])
+        """分割点云, 小聚类中的点不作为特征点"""
+        if self.segmentation:
+            _, outlier = self.LEGO_cloudhandler.cloudsegmentation(pcn, ground)
+            exclude = outlier | ground if self.ground_removal else outlier[processed_index]
 
         """提取竖线和平面"""
+        points = pcn.points if processed_index is None else pcn.points[processed_index]
+        curv, sector_index = self._get_curvature(points, step, exclude)
+        edge_index_list, plane_index_list = [], []
         for sector in range(6):
-            curv_list = []
-            for i in range(int(len(self.processed_pcn)/6)):
-                i = i + int(len(self.processed_pcn) / 6 ) * sector
-                
-                x = self.processed_pcn[i][0]
-                y = self.processed_pcn[i][1]
-                z = self.processed_pcn[i][2]
-                r0 = x**2 + y**2 + z**2
-                
-                curv = 0
-                sum = [0, 0, 0]
-                sum2 = 0
-                
-                if((i - 12 * 5 >= 0 ) & (i + 12 * 5 < len(self.processed_pcn))):
-                    for j in range(5):
-                        next_index = i + 12 * j
-                        last_index = i - 12 * j
-                        sum[0] += (x - self.processed_pcn[last_index][0])
-                        sum[0] += (x - self.processed_pcn[next_index][0])
-                        sum[1] += (y - self.processed_pcn[last_index][1])
-                        sum[1] += (y - self.processed_pcn[next_index][1])
-                        sum[2] += (z - self.processed_pcn[last_index][2])
-                        sum[2] += (z - self.processed_pcn[next_index][2])
-                        
-                        sum2 += (x - self.processed_pcn[last_index][0])**2 + (y - self.processed_pcn[last_index][1])**2 + (z - self.processed_pcn[last_index][2])**2
-                        sum2 += (x - self.processed_pcn[next_index][0])**2 + (y - self.processed_pcn[next_index][1])**2 + (z - self.processed_pcn[next_index][2])**2
-
-                    curv = (sum[0] ** 2 + sum[1] ** 2 + sum[2] ** 2) / (sum2)
-                    
-                    next_index = i + 12 * 5
-                    last_index = i - 12 * 5
-                    rl = self.processed_pcn[last_index][0]**2 + self.processed_pcn[last_index][1]**2 + self.processed_pcn[last_index][2]**2
-                    rn = self.processed_pcn[next_index][0]**2 + self.processed_pcn[next_index][1]**2 + self.processed_pcn[next_index][2]**2
-                    if (abs(rl - r0) / r0 > 0.2) or (abs(rn - r0) / r0 > 0.2):
-                        #self.edge_points.append(self.processed_pcn[i])
-                        curv = nan
-                        
-                    curv_list.append(curv)
-                    
-            index = np.argsort(np.array(curv_list))
-            edge_index = []
-            plane_index = []
-
-            for j in range(len(index)):
-                if (len(plane_index) >= 100):  #精准度&速度
-                    break
-                if curv_list[index[j]] > 0:
-                    flag = 1
-                    for k in range(5):
-                        if (index[j] + k < len(curv_list)):
-                            if (curv_list[index[j]] > curv_list[index[j] + k]): flag = 0
-                        if (index[j] - k > 0):
-                            if (curv_list[index[j]] > curv_list[index[j] - k]): flag = 0
-                    if (flag == 1):
-                        plane_index.append(index[j])
-                
-            index = np.flipud(index)
-            for j in range(len(index)): 
-                if (len(edge_index) >= 100):  #精准度&速度
-                    break
-                if ((not(math.isnan(curv_list[index[j]]))) & (curv_list[index[j]] < 100)):
-                    flag = 1
-                    for k in range(5):
-                        if (index[j] + k < len(curv_list)):
-                            if (curv_list[index[j]] < curv_list[index[j] + k]): flag = 0
-                        if (index[j] - k > 0):
-                            if (curv_list[index[j]] < curv_list[index[j] - k]): flag = 0
-                    if (flag == 1):
-                        edge_index.append(index[j])
-            
-            for ind in edge_index:
-                ind += int(len(self.processed_pcn) / 6 ) * sector
-                if sector == 0:
-                    ind += 12 * 5
-                self.edge_points.append(self.processed_pcn[ind])
-                self.edge_points_index.append(ind)
-
-            for ind in plane_index:
-                ind += int(len(self.processed_pcn) / 6 ) * sector
-                if sector == 0:
-                    ind += 12 * 5
-                self.plane_points.append(self.processed_pcn[ind])
-                self.plane_points_index.append(ind)
-         
-        self.edge_points = np.array(self.edge_points)
-        self.plane_points = np.array(self.plane_points)
+            start, end = sector_index[sector]
+            curv_list = curv[start:end]
+
+            edge_index, plane_index = self._select_features(curv_list)
+            edge_index_list.append(edge_index + start + step * 5)
+            plane_index_list.append(plane_index + start + step * 5)
+
+        """特征点索引为processed_pcn(地面分割时为整帧, 否则为去掉最下面4线的点)中的位置"""
+        self.edge_points_index = np.concatenate(edge_index_list)
+        self.plane_points_index = np.concatenate(plane_index_list)
+        if processed_index is None:
+            self.edge_points = pcn.take(self.edge_points_index)
+            self.plane_points = pcn.take(self.plane_points_index)
+        else:
+            self.edge_points = pcn.take(processed_index[self.edge_points_index])
+            self.plane_points = pcn.take(processed_index[self.plane_points_index])
         self.features = [self.edge_points, self.plane_points, self.edge_points_index, self.plane_points_index]
         
         return 1
 
+    def _select_features(self, curv_list):
+        """非极大值抑制选取一个扇区的边缘点和平面点
+
+        平面点取窗口内曲率最小且大于plane_curv_min的点, 边缘点取窗口内曲率最大且小于
+        edge_curv_max的点, 各按曲率排序取前plane_num/edge_num个. nan不参与比较,
+        扇区第0个点不作为邻点.
+        """
+        n = curv_list.shape[0]
+        w = self.nms_window - 1
+        if n == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        valid = ~np.isnan(curv_list)
+        low = np.where(valid, curv_list, np.inf)
+        high = np.where(valid, curv_list, -np.inf)
+        low[0], high[0] = np.inf, -np.inf
+
+        """滑动窗口内邻点(不含自身)的最小/最大值"""
+        low_win = sliding_window_view(np.pad(low, w, constant_values=np.inf), 2 * w + 1)
+        high_win = sliding_window_view(np.pad(high, w, constant_values=-np.inf), 2 * w + 1)
+        nb_min = np.minimum(low_win[:, :w].min(axis=1, initial=np.inf), low_win[:, w + 1:].min(axis=1, initial=np.inf))
+        nb_max = np.maximum(high_win[:, :w].max(axis=1, initial=-np.inf), high_win[:, w + 1:].max(axis=1, initial=-np.inf))
+
+        plane_mask = (curv_list > self.plane_curv_min) & (curv_list <= nb_min)
+        edge_mask = valid & (curv_list < self.edge_curv_max) & (curv_list >= nb_max)
+
+        plane_index = self._top_k(np.flatnonzero(plane_mask), curv_list, self.plane_num)
+        edge_index = self._top_k(np.flatnonzero(edge_mask), -curv_list, self.edge_num)
+
+        return edge_index, plane_index
+
+    def _top_k(self, candidate, key, k):
+        """按key从小到大取前k个候选点"""
+        if candidate.shape[0] > k:
+            candidate = candidate[np.argpartition(key[candidate], k - 1)[:k]] if k > 0 else candidate[:0]
+
+        return candidate[np.argsort(key[candidate], kind='stable')]
+
+    def _get_curvature(self, pcn, step=12, exclude=None):
+        """整帧批量计算曲率
+
+        邻点为同一线上前后各4个点(步长step, 即每列点数), 遮挡判断用前后第5个点的距离跳变,
+        pcn为n*3坐标(或前3列为坐标的数组). 跳变超过20%的点和被排除的点(exclude, 如地面点)曲率置为nan. 返回曲率数组(第k个对应第k+5*step个点)
+        和6个扇区在曲率数组中的起止位置.
+        """
+        n = pcn.shape[0]
+        half = step * 5
+        m = max(n - 2 * half, 0)
+
+        p = pcn[:, :3]
+        center = p[half:half + m]
+
+        """按原逐点循环的累加顺序计算. 计算精度与pcn一致: ScanFrame的float32坐标下与逐点计算逐位一致;
+        float64坐标下曲率有舍入误差级的差异, 在测试的各帧上选出的边缘点/平面点相同"""
+        s = np.zeros((m, 3))
+        s2 = np.zeros(m)
+        for j in range(5):
+            next_p = p[half + step * j:half + step * j + m]
+            last_p = p[half - step * j:half - step * j + m]
+            d_last = center - last_p
+            d_next = center - next_p
+            s += d_last
+            s += d_next
+            s2 += d_last[:, 0]**2 + d_last[:, 1]**2 + d_last[:, 2]**2
+            s2 += d_next[:, 0]**2 + d_next[:, 1]**2 + d_next[:, 2]**2
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            curv = (s[:, 0]**2 + s[:, 1]**2 + s[:, 2]**2) / s2
+
+            """距离跳变(遮挡)"""
+            r = p[:, 0]**2 + p[:, 1]**2 + p[:, 2]**2
+            r0 = r[half:half + m]
+            rl = r[:m]
+            rn = r[2 * half:2 * half + m]
+            jump = (np.abs(rl - r0) / r0 > 0.2) | (np.abs(rn - r0) / r0 > 0.2)
+        curv[jump] = nan
+        if exclude is not None:
+            curv[exclude[half:half + m]] = nan
+
+        """扇区边界"""
+        sector_len = int(n / 6)
+        sector_index = []
+        for sector in range(6):
+            start = min(max(sector_len * sector, half), half + m) - half
+            end = max(min(sector_len * (sector + 1), half + m), half) - half
+            sector_index.append((start, max(start, end)))
+
+        return curv, sector_index
+
 
 class LidarOdometry():
     """
     LOAM算法激光里程计
     """
-    def __init__(self):
+    def __init__(self, solver="LM", robust_kernel="huber", robust_delta=0.2, max_iter=10, step_tol=1e-6, cost_tol=1e-6, research_distance=0.05, max_distance=5.0):
         self.last_features = []
         self.init_flag = 0
-        self.T_list = []
+        self.T_last = None      #上一次优化得到的帧间位姿
         self.T = np.array([0.1, 0.1, 0.1, 0.1, 0.1, 0.1])
+
+        """迭代之间复用的对应关系"""
+        self.research_distance = research_distance  #变换后的点移动超过该距离(m)时重新查找近邻
+        self.max_distance = max_distance            #近邻远于该距离(m, LOAM为平方距离25)时不作为对应点
+        self.correspondence = None
+        self.correspondence_info = {"reused": 0, "refreshed": 0}    #本帧各次迭代累计复用/重新查找的点数
+
+        """优化器配置"""
+        self.solvers = {"GN": self.NewtonGussian, "LM": self.LevenbergMarquardt}
+        self.solver = solver                #"GN"或"LM"
+        self.robust_kernel = robust_kernel  #"huber", "cauchy"或None
+        self.robust_delta = robust_delta    #鲁棒核阈值(m), 也用于统计内点
+        self.max_iter = max_iter
+        self.step_tol = step_tol            #步长收敛阈值(相对)
+        self.cost_tol = cost_tol            #代价变化收敛阈值(相对)
+        self.solver_info = {}               #每帧迭代次数, 最终代价, 有效匹配数, 内点率
+        self.match_valid = np.zeros(0, dtype=bool)  #最近一次matching中有对应关系且不退化的匹配
         
-        self.flag = 0
-        self.var = []
-        
-    def process(self, features):
-        """主程序"""
+    def process(self, features, T0=None):
+        """主程序, T0为迭代初值(如IMU预积分结果), 默认从0开始"""
         if self.init_flag == 0:
-            self.last_features = features
+            self.set_last_features(features)
             self.init_flag = 1
             
         elif self.init_flag == 1:
-            self.NewtonGussian(features)
-            self.last_features = features
+            self.solvers[self.solver](features, T0)
+            self.set_last_features(features)
 
-    def NewtonGussian(self, features):
-        """牛顿高斯法优化"""
-        x = np.array([0,0,0,0,0,0])
-        
-        print("___________")
-        for num in range(3):
-            f, j = self.matching(features, x)
-            x = (x.reshape(6,1) - 3 * np.matmul(np.matmul(np.array(np.linalg.inv(np.matmul(j.T, j) + 1e-2 * np.eye(6))), j.T), f)).reshape(6)
-            self.T = x
-            #print("\r x = %s ,f = %s" % (x.reshape(6), np.linalg.norm(f)), end = "")
-            if np.linalg.norm(f)<10:
+    def set_last_features(self, features):
+        """保存上一帧特征并建立KD树和按线号的索引, 每帧只建一次"""
+        self.last_features = features
+        self.last_edge_tree = cKDTree(features[0][:, :3])
+        self.last_plane_tree = cKDTree(features[1][:, :3])
+        self.last_edge_rings = RingIndex(features[0])
+        self.last_plane_rings = RingIndex(features[1])
+        self.correspondence = None
+
+    def NewtonGussian(self, features, T0=None):
+        """高斯-牛顿法优化
+
+        与LevenbergMarquardt使用相同的残差, 鲁棒核和收敛条件, 每次迭代走完整的高斯-牛顿步长,
+        不做阻尼和步长检验. 结果写入self.T, self.T_last和self.solver_info. T0为迭代初值, 默认为0.
+        """
+        x = np.zeros(6) if T0 is None else np.array(T0, dtype=float)
+        F, J, valid = self._get_lm_residual(features, x)
+        cost, A, g = self._get_lm_system(F, J)
+
+        num = 0
+        for num in range(1, self.max_iter + 1):
+            try:
+                h = cho_solve(cho_factor(A + 1e-9 * np.eye(6)), -g)     #极小的正则项, 只为退化时能分解
+            except np.linalg.LinAlgError:
                 break
-            
-        self.T_list.append(x)   #调用最后一位即可
-        
+            if np.linalg.norm(h) < self.step_tol * (np.linalg.norm(x) + self.step_tol):
+                break
+
+            x = x + h
+            F, J, valid = self._get_lm_residual(features, x)
+            cost_new, A, g = self._get_lm_system(F, J)
+            converged = abs(cost - cost_new) < self.cost_tol * max(cost, self.cost_tol)
+            cost = cost_new
+            if converged:
+                break
+
+        self.T = x
+        self.T_last = x
+        self.solver_info = self._get_solver_info(num, cost, F, valid)
+
         return 1
+
+    def LevenbergMarquardt(self, features, T0=None):
+        """列文伯格-马夸尔特法优化
+
+        自适应阻尼, Cholesky求解6*6法方程, 鲁棒核对外点降权,
+        步长或代价变化足够小时收敛. 结果写入self.T, self.T_last和self.solver_info.
+        T0为迭代初值, 默认为0.
+        """
+        x = np.zeros(6) if T0 is None else np.array(T0, dtype=float)
+        F, J, valid = self._get_lm_residual(features, x)
+        cost, A, g = self._get_lm_system(F, J)
+        u = 1e-5 * np.max(np.diag(A)) if A.any() else 1e-5
+        v = 2.0
+
+        num = 0
+        for num in range(1, self.max_iter + 1):
+            try:
+                h = cho_solve(cho_factor(A + u * np.eye(6)), -g)
+            except np.linalg.LinAlgError:
+                u, v = u * v, 2 * v
+                continue
+
+            if np.linalg.norm(h) < self.step_tol * (np.linalg.norm(x) + self.step_tol):
+                break
+
+            x_new = x + h
+            F_new, J_new, valid_new = self._get_lm_residual(features, x_new)
+            cost_new, A_new, g_new = self._get_lm_system(F_new, J_new)
+
+            """增益比: 实际下降/线性模型预测下降"""
+            rho = (cost - cost_new) / (0.5 * np.dot(h, u * h - g))
+            if rho > 0:
+                converged = abs(cost - cost_new) < self.cost_tol * max(cost, self.cost_tol)
+                x, F, valid, cost, A, g = x_new, F_new, valid_new, cost_new, A_new, g_new
+                u = u * max(1 / 3, 1 - (2 * rho - 1) ** 3)
+                v = 2.0
+                if converged:
+                    break
+            else:
+                u, v = u * v, 2 * v
+
+        self.T = x
+        self.T_last = x
+        self.solver_info = self._get_solver_info(num, cost, F, valid)
+
+        return 1
+
+    def _get_solver_info(self, iterations, cost, F, valid):
+        """迭代次数, 最终代价和内点率; 内点率只在有效匹配(有对应关系且不退化)中统计"""
+        return {
+            "iterations": iterations,
+            "cost": float(cost),
+            "valid": int(np.count_nonzero(valid)),
+            "inlier_ratio": float(np.mean(np.abs(F[valid]) <= self.robust_delta)) if valid.any() else 0.0,
+        }
+
+    def _get_lm_residual(self, features, x):
+        """残差, 雅可比和有效匹配的掩码; 边缘点的雅可比由h^2的导数换算为h的导数"""
+        f, j = self.matching(features, x)
+        f, j = f.reshape(-1), j.copy()
+        n_edge = features[0].shape[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            j[:n_edge] = np.where(f[:n_edge, np.newaxis] > 0, j[:n_edge] / (2 * f[:n_edge, np.newaxis]), 0)
+
+        return f, j, self.match_valid.copy()
+
+    def _get_lm_system(self, F, J):
+        """鲁棒核加权的代价和法方程(J^T W J, J^T W F)"""
+        r = np.abs(F)
+        delta = self.robust_delta
+        if self.robust_kernel == "huber":
+            w = np.where(r <= delta, 1.0, delta / np.maximum(r, delta))
+            cost = np.sum(np.where(r <= delta, 0.5 * r ** 2, delta * (r - 0.5 * delta)))
+        elif self.robust_kernel == "cauchy":
+            w = 1 / (1 + (r / delta) ** 2)
+            cost = np.sum(0.5 * delta ** 2 * np.log1p((r / delta) ** 2))
+        else:
+            w = np.ones_like(r)
+            cost = np.sum(0.5 * r ** 2)
+
+        A = J.T @ (w[:, np.newaxis] * J)
+        g = J.T @ (w * F)
+
+        return cost, A, g
     
     def matching(self, features, T):
-        """特征点匹配"""
+        """特征点匹配
+
+        对应关系在同一帧的各次迭代之间复用, 只有变换后移动超过research_distance的点重新查找近邻.
+        """
         [edge_points, plane_points, self.edge_points_index, self.plane_points_index] = features
         [last_edge_points, last_plane_points, _, _] = self.last_features
         
@@ -206,65 +616,92 @@ class LidarOdometry():
         edge_points = self.transform(edge_points, T)
         plane_points = self.transform(plane_points, T)
         
-        n = edge_points.shape[0]
         n = edge_points.shape[0] + plane_points.shape[0]
-        F, J = np.zeros(n),  np.zeros((n, 6))
-        
-        """边缘点匹配"""
-        for i in range(edge_points.shape[0]):
-            edge_point = np.array(edge_points[i][:3])
-            last_points = np.array(last_edge_points[:,:3])
-            
-            if self.flag == 0:
-                distance = np.linalg.norm(last_points - edge_point, axis = 1)
-                nearest_index = np.argmax(-distance)
-                near_angle_index = (nearest_index - 1) if (nearest_index - 1) >= 0 else (nearest_index + 1)
-                
-                self.var = [nearest_index, near_angle_index]
-                self.flag = 0
-            
-            [nearest_index, near_angle_index] = self.var
-            d = np.linalg.norm(last_points[nearest_index] - last_points[near_angle_index])
-            s = np.linalg.norm(np.cross(last_points[nearest_index] - edge_point, last_points[near_angle_index] - edge_point))
-            h = (s / d)
-            
-            J[i] = self._get_jacobi_edge(raw_edge_points[i][:3], last_points[nearest_index], last_points[near_angle_index], T)
-            F[i] = h
-        
+
+        """本帧第一次匹配时清空缓存"""
+        if self.correspondence is None or self.correspondence["features"] is not features:
+            self.correspondence = {
+                "features": features,
+                "edge": {"position": np.full((edge_points.shape[0], 3), np.nan), "index": np.zeros((edge_points.shape[0], 2), dtype=int)},
+                "plane": {"position": np.full((plane_points.shape[0], 3), np.nan), "index": np.zeros((plane_points.shape[0], 3), dtype=int)},
+            }
+            self.correspondence_info = {"reused": 0, "refreshed": 0}
+        edge_index = self._update_correspondence(self.correspondence["edge"], edge_points[:, :3], self._search_edge)
+        plane_index = self._update_correspondence(self.correspondence["plane"], plane_points[:, :3], self._search_plane)
+
+        """边缘点匹配, 没有对应关系(索引为-1)的点残差和雅可比为0"""
+        last_points = last_edge_points[:, :3]
+        F_edge, J_edge = np.zeros(edge_index.shape[0]), np.zeros((edge_index.shape[0], 6))
+        valid_edge = edge_index[:, 0] >= 0
+        if valid_edge.any():
+            index = edge_index[valid_edge]
+            p2, p3 = last_points[index[:, 0]], last_points[index[:, 1]]
+            F_edge[valid_edge], J_edge[valid_edge] = self._get_edge_factor(raw_edge_points[valid_edge, :3], p2, p3, T)
+            valid_edge[valid_edge] = (p2 != p3).any(axis=1)
+
         """平面点匹配"""
-        for i in range(plane_points.shape[0]):
-            plane_point = np.array(plane_points[i][:3])
-            last_points = np.array(last_plane_points[:,:3])
-            distance = np.linalg.norm(last_points - plane_point, axis = 1)
-            nearest_index = np.argmax(-distance)
-            
-            near_angle_index = (nearest_index - 1) if (nearest_index - 1) >= 0 else (nearest_index + 1)
-        
-            for delta in range(32):
-                if nearest_index + delta + 1 < last_plane_points.shape[0]:
-                    if last_plane_points[nearest_index + delta + 1][3] == last_plane_points[nearest_index][3] :
-                        near_scan_index = nearest_index + delta + 1
-                        break
-                    else:
-                        near_scan_index = nearest_index + delta + 1
-                else: 
-                    if last_plane_points[nearest_index - delta - 1][3] == last_plane_points[nearest_index][3] :
-                        near_scan_index = nearest_index - delta - 1
-                        break
-
-            s = (np.cross(last_points[nearest_index] - last_points[near_angle_index], last_points[nearest_index] - last_points[near_scan_index]))
-            h = np.dot(last_points[nearest_index] - plane_point, s / np.linalg.norm(s))
-            
-            if math.isnan(h): h = 0
-            if not math.isnan(h):
-                J[i + edge_points.shape[0]] = 1 * self._get_jacobi_plane(raw_plane_points[i][:3], last_points[nearest_index], last_points[near_angle_index], last_points[near_scan_index], T)
-                F[i + edge_points.shape[0]] = 1 * h 
-            else:
-                J[i + edge_points.shape[0]] = self._get_jacobi_plane(raw_plane_points[i][:3], last_points[nearest_index], last_points[near_angle_index], last_points[near_scan_index], T)
-                F[i + edge_points.shape[0]] = h
-                print("h==Nan")
-            
+        last_points = last_plane_points[:, :3]
+        F_plane, J_plane = np.zeros(plane_index.shape[0]), np.zeros((plane_index.shape[0], 6))
+        valid_plane = plane_index[:, 0] >= 0
+        if valid_plane.any():
+            index = plane_index[valid_plane]
+            p2, p3, p4 = last_points[index[:, 0]], last_points[index[:, 1]], last_points[index[:, 2]]
+            F_plane[valid_plane], J_plane[valid_plane] = self._get_plane_factor(raw_plane_points[valid_plane, :3], p2, p3, p4, T)
+            valid_plane[valid_plane] = (np.cross(p2 - p3, p2 - p4) != 0).any(axis=1)
+
+        F = np.concatenate((F_edge, F_plane))
+        J = np.concatenate((J_edge, J_plane))
+        self.match_valid = np.concatenate((valid_edge, valid_plane))    #有对应关系且不退化的匹配
+
         return F.reshape((n, 1)), J.reshape((n, 6))
+
+    def _update_correspondence(self, cache, points, search):
+        """移动超过research_distance(或尚未查找)的点重新查找, 返回全部点的对应关系"""
+        moved = ~(np.linalg.norm(points - cache["position"], axis=1) <= self.research_distance)
+        refreshed = int(np.count_nonzero(moved))
+        if refreshed:
+            cache["index"][moved] = search(points[moved])
+            cache["position"][moved] = points[moved]
+        self.correspondence_info["refreshed"] += refreshed
+        self.correspondence_info["reused"] += points.shape[0] - refreshed
+
+        return cache["index"]
+
+    def _search_edge(self, points):
+        """边缘点在上一帧的最近点j及相邻线上离它最近的点l, 返回m*2索引
+
+        找不到l(或l远于max_distance)时取j, 直线退化, 该匹配不参与优化.
+        上一帧没有边缘点或j远于max_distance时索引为-1.
+        """
+        if self.last_features[0].shape[0] == 0:
+            return np.full((points.shape[0], 2), -1)
+        distance, nearest_index = self.last_edge_tree.query(points, k=1)
+        rings = self.last_features[0][nearest_index, 3]
+        near_scan_index = self.last_edge_rings.query_adjacent(points, rings, self.max_distance)
+        near_scan_index = np.where(near_scan_index >= 0, near_scan_index, nearest_index)
+
+        index = np.stack((nearest_index, near_scan_index), axis=1)
+        index[distance > self.max_distance] = -1
+        return index
+
+    def _search_plane(self, points):
+        """平面点在上一帧的最近点j, 同一线上离它最近的另一点l和相邻线上最近的点m, 返回m*3索引
+
+        找不到l或m(或远于max_distance)时取j, 平面退化, 该匹配不参与优化.
+        上一帧没有平面点或j远于max_distance时索引为-1.
+        """
+        if self.last_features[1].shape[0] == 0:
+            return np.full((points.shape[0], 3), -1)
+        distance, nearest_index = self.last_plane_tree.query(points, k=1)
+        rings = self.last_features[1][nearest_index, 3]
+        same_scan_index = self.last_plane_rings.query(points, rings, exclude=nearest_index, max_distance=self.max_distance)
+        near_scan_index = self.last_plane_rings.query_adjacent(points, rings, self.max_distance)
+        same_scan_index = np.where(same_scan_index >= 0, same_scan_index, nearest_index)
+        near_scan_index = np.where(near_scan_index >= 0, near_scan_index, nearest_index)
+
+        index = np.stack((nearest_index, same_scan_index, near_scan_index), axis=1)
+        index[distance > self.max_distance] = -1
+        return index
     
     def matching2(self, features, T):
         """特征点匹配"""
@@ -292,249 +729,288 @@ class LidarOdometry():
                 
         
         
-    def _get_jacobi_edge(self, p1, p2, p3, T):
-        [x_1, y_1, z_1], [x_2, y_2, z_2], [x_3, y_3, z_3] = p1, p2, p3
-        [alpha, beta, gamma, x, y, z] = T
-        
-        j11 = (2*(x_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.cos(gamma) - np.sin(beta)*np.sin(gamma)*np.cos(alpha)) - z_1*np.cos(alpha)*np.cos(beta))*(-x - x_1*np.cos(beta)*np.cos(gamma) + x_2 + y_1*np.sin(gamma)*np.cos(beta) - z_1*np.sin(beta)) + 2*(x_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.cos(gamma) - np.sin(beta)*np.sin(gamma)*np.cos(alpha)) - z_1*np.cos(alpha)*np.cos(beta))*(x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta)))*(-(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta))) + (2*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - z_1*np.sin(alpha)*np.cos(beta))*(-x - x_1*np.cos(beta)*np.cos(gamma) + x_3 + y_1*np.sin(gamma)*np.cos(beta) - z_1*np.sin(beta)) + 2*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - z_1*np.sin(alpha)*np.cos(beta))*(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta)))*((x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) - (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)) + ((x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) - (x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))*(2*(-x_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)) - y_1*(-np.sin(alpha)*np.cos(gamma) - np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z_1*np.cos(alpha)*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) + 2*(x_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.cos(gamma) - np.sin(beta)*np.sin(gamma)*np.cos(alpha)) - z_1*np.cos(alpha)*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2) + 2*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - z_1*np.sin(alpha)*np.cos(beta))*(-x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) - y - y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_2 + z_1*np.sin(alpha)*np.cos(beta)) + 2*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - z_1*np.sin(alpha)*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)))
-        j12 = ((x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) - (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2))*(2*(-x_1*np.sin(beta)*np.cos(gamma) + y_1*np.sin(beta)*np.sin(gamma) + z_1*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) + 2*(x_1*np.sin(beta)*np.cos(gamma) - y_1*np.sin(beta)*np.sin(gamma) - z_1*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2) + 2*(-x_1*np.cos(alpha)*np.cos(beta)*np.cos(gamma) + y_1*np.sin(gamma)*np.cos(alpha)*np.cos(beta) - z_1*np.sin(beta)*np.cos(alpha))*(-x - x_1*np.cos(beta)*np.cos(gamma) + x_3 + y_1*np.sin(gamma)*np.cos(beta) - z_1*np.sin(beta)) + 2*(-x_1*np.cos(alpha)*np.cos(beta)*np.cos(gamma) + y_1*np.sin(gamma)*np.cos(alpha)*np.cos(beta) - z_1*np.sin(beta)*np.cos(alpha))*(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))) + (-(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))*(2*(-x_1*np.sin(beta)*np.cos(gamma) + y_1*np.sin(beta)*np.sin(gamma) + z_1*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)) + 2*(x_1*np.sin(beta)*np.cos(gamma) - y_1*np.sin(beta)*np.sin(gamma) - z_1*np.cos(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + 2*(x_1*np.sin(alpha)*np.cos(beta)*np.cos(gamma) - y_1*np.sin(alpha)*np.sin(gamma)*np.cos(beta) + z_1*np.sin(alpha)*np.sin(beta))*(-x - x_1*np.cos(beta)*np.cos(gamma) + x_2 + y_1*np.sin(gamma)*np.cos(beta) - z_1*np.sin(beta)) + 2*(x_1*np.sin(alpha)*np.cos(beta)*np.cos(gamma) - y_1*np.sin(alpha)*np.sin(gamma)*np.cos(beta) + z_1*np.sin(alpha)*np.sin(beta))*(x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))) + ((x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) - (x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))*(2*(-x_1*np.sin(alpha)*np.cos(beta)*np.cos(gamma) + y_1*np.sin(alpha)*np.sin(gamma)*np.cos(beta) - z_1*np.sin(alpha)*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) + 2*(x_1*np.sin(alpha)*np.cos(beta)*np.cos(gamma) - y_1*np.sin(alpha)*np.sin(gamma)*np.cos(beta) + z_1*np.sin(alpha)*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2) + 2*(-x_1*np.cos(alpha)*np.cos(beta)*np.cos(gamma) + y_1*np.sin(gamma)*np.cos(alpha)*np.cos(beta) - z_1*np.sin(beta)*np.cos(alpha))*(-x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) - y - y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_2 + z_1*np.sin(alpha)*np.cos(beta)) + 2*(-x_1*np.cos(alpha)*np.cos(beta)*np.cos(gamma) + y_1*np.sin(gamma)*np.cos(alpha)*np.cos(beta) - z_1*np.sin(beta)*np.cos(alpha))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)))
-        j13 = ((x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) - (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2))*(2*(x_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)))*(-x - x_1*np.cos(beta)*np.cos(gamma) + x_3 + y_1*np.sin(gamma)*np.cos(beta) - z_1*np.sin(beta)) + 2*(x_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)))*(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta)) + 2*(-x_1*np.sin(gamma)*np.cos(beta) - y_1*np.cos(beta)*np.cos(gamma))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) + 2*(x_1*np.sin(gamma)*np.cos(beta) + y_1*np.cos(beta)*np.cos(gamma))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)) + (-(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))*(2*(x_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.cos(gamma) - np.sin(gamma)*np.cos(alpha)))*(-x - x_1*np.cos(beta)*np.cos(gamma) + x_2 + y_1*np.sin(gamma)*np.cos(beta) - z_1*np.sin(beta)) + 2*(x_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.cos(gamma) - np.sin(gamma)*np.cos(alpha)))*(x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta)) + 2*(-x_1*np.sin(gamma)*np.cos(beta) - y_1*np.cos(beta)*np.cos(gamma))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)) + 2*(x_1*np.sin(gamma)*np.cos(beta) + y_1*np.cos(beta)*np.cos(gamma))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta))) + ((x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) - (x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))*(2*(x_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)))*(-x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) - y - y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_2 + z_1*np.sin(alpha)*np.cos(beta)) + 2*(x_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + 2*(-x_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_1*(-np.sin(alpha)*np.sin(beta)*np.cos(gamma) - np.sin(gamma)*np.cos(alpha)))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) + 2*(x_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.cos(gamma) - np.sin(gamma)*np.cos(alpha)))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2))
-        j14 = (-2*y_2 + 2*y_3)*(-(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta))) + (2*z_2 - 2*z_3)*((x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) - (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2))
-        j15 = (2*x_2 - 2*x_3)*(-(x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) + (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta))) + (-2*z_2 + 2*z_3)*((x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) - (x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))
-        j16 = (-2*x_2 + 2*x_3)*((x + x_1*np.cos(beta)*np.cos(gamma) - x_2 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3) - (x + x_1*np.cos(beta)*np.cos(gamma) - x_3 - y_1*np.sin(gamma)*np.cos(beta) + z_1*np.sin(beta))*(x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)) + (2*y_2 - 2*y_3)*((x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_2)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_3 - z_1*np.sin(alpha)*np.cos(beta)) - (x_1*(np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + z + z_1*np.cos(alpha)*np.cos(beta) - z_3)*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - y_2 - z_1*np.sin(alpha)*np.cos(beta)))
-        
-        j = np.array([j11, j12, j13, j14, j15, j16])
-        j = j / ((-x_2 + x_3)**2 + (-y_2 + y_3)**2 + (-z_2 + z_3)**2)
+    def _get_edge_factor(self, p1, p2, p3, T):
+        """边缘点残差和雅可比(批量)
 
-        return j
-    
-    def _get_jacobi_plane(self, p1, p2, p3, p4, T):
-        [x_1, y_1, z_1], [x_2, y_2, z_2], [x_3, y_3, z_3], [x_4, y_4, z_4] = p1, p2, p3, p4
-        [alpha, beta, gamma, x, y, z] = T
-        
-        j21 = ((-x_2 + x_3)*(y_3 - y_4) - (x_3 - x_4)*(-y_2 + y_3))*(x_1*(np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) - z_1*np.sin(alpha)*np.cos(beta)) + (-(-x_2 + x_3)*(z_3 - z_4) + (x_3 - x_4)*(-z_2 + z_3))*(x_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.cos(gamma) - np.sin(beta)*np.sin(gamma)*np.cos(alpha)) - z_1*np.cos(alpha)*np.cos(beta))
-        j22 = ((-x_2 + x_3)*(y_3 - y_4) - (x_3 - x_4)*(-y_2 + y_3))*(-x_1*np.cos(alpha)*np.cos(beta)*np.cos(gamma) + y_1*np.sin(gamma)*np.cos(alpha)*np.cos(beta) - z_1*np.sin(beta)*np.cos(alpha)) + (-(-x_2 + x_3)*(z_3 - z_4) + (x_3 - x_4)*(-z_2 + z_3))*(x_1*np.sin(alpha)*np.cos(beta)*np.cos(gamma) - y_1*np.sin(alpha)*np.sin(gamma)*np.cos(beta) + z_1*np.sin(alpha)*np.sin(beta)) + ((-y_2 + y_3)*(z_3 - z_4) - (y_3 - y_4)*(-z_2 + z_3))*(-x_1*np.sin(beta)*np.cos(gamma) + y_1*np.sin(beta)*np.sin(gamma) + z_1*np.cos(beta))
-        j23 = (x_1*(np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha)) + y_1*(-np.sin(alpha)*np.sin(gamma) + np.sin(beta)*np.cos(alpha)*np.cos(gamma)))*((-x_2 + x_3)*(y_3 - y_4) - (x_3 - x_4)*(-y_2 + y_3)) + (x_1*(-np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma)) + y_1*(-np.sin(alpha)*np.sin(beta)*np.cos(gamma) - np.sin(gamma)*np.cos(alpha)))*(-(-x_2 + x_3)*(z_3 - z_4) + (x_3 - x_4)*(-z_2 + z_3)) + ((-y_2 + y_3)*(z_3 - z_4) - (y_3 - y_4)*(-z_2 + z_3))*(-x_1*np.sin(gamma)*np.cos(beta) - y_1*np.cos(beta)*np.cos(gamma))
-        j24 = (-y_2 + y_3)*(z_3 - z_4) - (y_3 - y_4)*(-z_2 + z_3)
-        j25 = -(-x_2 + x_3)*(z_3 - z_4) + (x_3 - x_4)*(-z_2 + z_3)
-        j26 = (-x_2 + x_3)*(y_3 - y_4) - (x_3 - x_4)*(-y_2 + y_3)
-        
-        j = np.array([j21, j22, j23, j24, j25, j26])
-        j = j / np.sqrt(((-x_2 + x_3)*(y_3 - y_4) - (x_3 - x_4)*(-y_2 + y_3))**2 + (-(-x_2 + x_3)*(z_3 - z_4) + (x_3 - x_4)*(-z_2 + z_3))**2 + ((-y_2 + y_3)*(z_3 - z_4) - (y_3 - y_4)*(-z_2 + z_3))**2)
+        p1为当前帧点(变换前), p2, p3为上一帧直线上两点, 均为n*3.
+        残差为p1变换后到直线p2p3的距离h, 雅可比为h^2对T的导数(与test_jacobian中SymPy推导的参考实现一致).
+        退化(p2, p3重合)的匹配残差和雅可比置0.
+        """
+        R, dR = self._get_dR(T)
+        p = p1 @ R.T + T[3:6]
+        u = p2 - p3
+        c = np.cross(p - p2, p - p3)
+        d2 = np.einsum("ni,ni->n", u, u)
 
-        return j
-        
-    def _get_R(self, T):
-        alpha = T[0]
-        beta = T[1]
-        gamma = T[2]
-        R = np.array([[np.cos(beta)*np.cos(gamma), -np.sin(gamma)*np.cos(beta), np.sin(beta)], [np.sin(alpha)*np.sin(beta)*np.cos(gamma) + np.sin(gamma)*np.cos(alpha), -np.sin(alpha)*np.sin(beta)*np.sin(gamma) + np.cos(alpha)*np.cos(gamma), -np.sin(alpha)*np.cos(beta)], [np.sin(alpha)*np.sin(gamma) - np.sin(beta)*np.cos(alpha)*np.cos(gamma), np.sin(alpha)*np.cos(gamma) + np.sin(beta)*np.sin(gamma)*np.cos(alpha), np.cos(alpha)*np.cos(beta)]])
-        
-        return R
+        with np.errstate(divide='ignore', invalid='ignore'):
+            F = np.sqrt(np.einsum("ni,ni->n", c, c) / d2)
+            grad = 2 * np.cross(u, c) / d2[:, np.newaxis]
+        J = np.concatenate((np.einsum("ni,kij,nj->nk", grad, dR, p1), grad), axis=1)
+
+        return self._drop_degenerate(F, J)
+
+    def _get_plane_factor(self, p1, p2, p3, p4, T):
+        """平面点残差和雅可比(批量)
+
+        p1为当前帧点(变换前), p2, p3, p4为上一帧平面上三点, 均为n*3.
+        残差为p1变换后到平面p2p3p4的有向距离h, 雅可比为h对T的导数(与test_jacobian中SymPy推导的参考实现一致).
+        退化(三点共线)的匹配残差和雅可比置0.
+        """
+        R, dR = self._get_dR(T)
+        p = p1 @ R.T + T[3:6]
+        s = np.cross(p2 - p3, p2 - p4)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normal = s / np.linalg.norm(s, axis=1)[:, np.newaxis]
+        F = np.einsum("ni,ni->n", p2 - p, normal)
+        grad = -normal
+        J = np.concatenate((np.einsum("ni,kij,nj->nk", grad, dR, p1), grad), axis=1)
+
+        return self._drop_degenerate(F, J)
+
+    def _drop_degenerate(self, F, J):
+        """残差或雅可比为nan的匹配不参与优化"""
+        invalid = np.isnan(F) | np.isnan(J).any(axis=1)
+        F[invalid] = 0
+        J[invalid] = 0
+
+        return F, J
+
+    def _get_dR(self, T):
+        """旋转矩阵及其对alpha, beta, gamma的导数, 每次迭代只算一次三角函数"""
+        sa, ca = np.sin(T[0]), np.cos(T[0])
+        sb, cb = np.sin(T[1]), np.cos(T[1])
+        sg, cg = np.sin(T[2]), np.cos(T[2])
+
+        Rx = np.array([[1, 0, 0], [0, ca, -sa], [0, sa, ca]])
+        Ry = np.array([[cb, 0, sb], [0, 1, 0], [-sb, 0, cb]])
+        Rz = np.array([[cg, -sg, 0], [sg, cg, 0], [0, 0, 1]])
+        dRx = np.array([[0, 0, 0], [0, -sa, -ca], [0, ca, -sa]])
+        dRy = np.array([[-sb, 0, cb], [0, 0, 0], [-cb, 0, -sb]])
+        dRz = np.array([[-sg, -cg, 0], [cg, -sg, 0], [0, 0, 0]])
+
+        R = Rx @ Ry @ Rz
+        dR = np.array([dRx @ Ry @ Rz, Rx @ dRy @ Rz, Rx @ Ry @ dRz])
+
+        return R, dR
 
-    def _get_t(self, T):
-        x = T[3]
-        y = T[4]
-        z = T[5]
-        t = np.array([x, y, z])
-        
-        return t
-    
     def transform(self, x, T):  #通过T（有R，t的属性）,6自由度属性，使点（我们用特征点）做变换
-        #print("T_everytime:",T)
-        R = self._get_R(T)
-        t = self._get_t(T)
-        x_vect, x_label = x[:,:3], x[:,3:]
-        x_vect = np.einsum("ij,nj->ni", R, x_vect) + t
-        x = np.concatenate((x_vect, x_label), axis=1)
-        
-        return x
+        """返回变换后的坐标(n*3, float64), 不复制标签列"""
+        return transform_points(np.asarray(x[:, :3], dtype=float), euler_to_matrix(T))
+
+
+class LidarMapping(LidarOdometry):
+    """
+    LOAM建图: 以较低频率将当前帧特征与局部地图匹配, 修正里程计累积漂移
+
+    里程计每帧调用add_odometry累积位姿, 每interval帧(10Hz输入时5帧即2Hz)做一次
+    scan-to-map优化, 得到修正量correction, 任一帧的全局位姿为correction @ 里程计位姿.
+    地图中的线/面由最近的5个点主成分分析拟合.
+    """
+    def __init__(self, interval=5, extent=2, max_distance=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = interval            #每interval帧建图一次
+        self.extent = extent                #匹配时使用当前立方体周围extent个立方体
+        self.max_distance = max_distance    #近邻距离上限(m)
+        self.local_map = LocalMap()
+        self.frame_count = 0
+        self.trajectory = Trajectory()      #每帧的里程计累积位姿
+        self.correction = np.eye(4)         #建图修正量
+        self.pose_list = []                 #每次建图后的全局位姿
+
+    def add_odometry(self, T=None, stamp=None):
+        """累积一帧里程计结果(首帧T为None), 返回该帧里程计位姿"""
+        odom_pose = self.trajectory.append(None if T is None else euler_to_matrix(T), stamp)
+        self.frame_count += 1
+
+        return odom_pose
+
+    def due(self):
+        """当前帧是否需要建图"""
+        return (self.frame_count - 1) % self.interval == 0
+
+    def pose(self, odom_pose):
+        """里程计位姿对应的全局位姿"""
+        return self.correction @ odom_pose
+
+    def process(self, features, odom_pose):
+        """主程序: 修正一帧的全局位姿并加入局部地图
+
+        匹配只用坐标, 局部地图中也只存变换后的坐标(n*3), 不复制特征点的标签列.
+        """
+        predict = self.pose(odom_pose)
+        features = [transform_points(features[0], predict), transform_points(features[1], predict)]
+
+        map_edge = self.local_map.get("edge", predict[:3, 3], self.extent)
+        map_plane = self.local_map.get("plane", predict[:3, 3], self.extent)
+        if map_edge.shape[0] >= 5 and map_plane.shape[0] >= 5:
+            self.map_edge_points, self.map_plane_points = map_edge[:, :3], map_plane[:, :3]
+            self.map_edge_tree = cKDTree(self.map_edge_points)
+            self.map_plane_tree = cKDTree(self.map_plane_points)
+            self.LevenbergMarquardt(features)
+
+            delta = euler_to_matrix(self.T)
+            features = [transform_points(features[0], delta, out=features[0]), transform_points(features[1], delta, out=features[1])]
+            predict = delta @ predict
+
+        self.correction = predict @ np.linalg.inv(odom_pose)
+        self.pose_list.append(predict)
+        self.local_map.insert("edge", features[0])
+        self.local_map.insert("plane", features[1])
+        self.local_map.evict(predict[:3, 3])
+
+        return predict
+
+    def matching(self, features, T):
+        """特征点与局部地图匹配"""
+        edge_points, plane_points = features[0][:, :3], features[1][:, :3]
+
+        """边缘点: 近邻主方向明显时视为直线"""
+        dist, index = self.map_edge_tree.query(self.transform(edge_points, T), k=5)
+        centroid, values, vectors = self._get_pca(self.map_edge_points[index])
+        direction = vectors[:, :, 2]
+        F_edge, J_edge = self._get_edge_factor(edge_points, centroid + 0.1 * direction, centroid - 0.1 * direction, T)
+        invalid_edge = (dist[:, -1] > self.max_distance) | (values[:, 2] < 3 * values[:, 1])
+        F_edge[invalid_edge], J_edge[invalid_edge] = 0, 0
+
+        """平面点: 近邻到拟合平面的距离都小于0.2m时视为平面"""
+        dist, index = self.map_plane_tree.query(self.transform(plane_points, T), k=5)
+        neighbours = self.map_plane_points[index]
+        centroid, values, vectors = self._get_pca(neighbours)
+        normal = vectors[:, :, 0]
+        F_plane, J_plane = self._get_plane_factor(plane_points, centroid, centroid + vectors[:, :, 1], centroid + vectors[:, :, 2], T)
+        plane_error = np.abs(np.einsum("nki,ni->nk", neighbours - centroid[:, np.newaxis], normal)).max(axis=1)
+        invalid_plane = (dist[:, -1] > self.max_distance) | (plane_error > 0.2)
+        F_plane[invalid_plane], J_plane[invalid_plane] = 0, 0
+
+        F = np.concatenate((F_edge, F_plane))
+        J = np.concatenate((J_edge, J_plane))
+        self.match_valid = ~np.concatenate((invalid_edge, invalid_plane))
+
+        return F.reshape((-1, 1)), J
+
+    def _get_pca(self, neighbours):
+        """近邻点的中心, 协方差特征值(升序)和特征向量"""
+        centroid = neighbours.mean(axis=1)
+        d = neighbours - centroid[:, np.newaxis]
+        values, vectors = np.linalg.eigh(np.einsum("nki,nkj->nij", d, d) / neighbours.shape[1])
+
+        return centroid, values, vectors
+
 
 
 class LEGO_cloudhandler():
-    def __init__(self):
-        self.rangematrix=np.zeros((16,1800))
-        self.index=np.zeros(28800)
-        self.queueIndX=np.zeros(28800)
-        self.queueIndY=np.zeros(28800)
-        self.allPushedIndX=np.zeros(28800)#used to track points of a segmented object
-        self.allPushedIndY=np.zeros(28800)
-        self.lablematrix=np.zeros((16,1800))
-        self.groundmetrix=np.zeros(28800)
+    def __init__(self, lidar_type="RS16"):
+        """距离图像的大小, 相邻格的角度间隔和地面线数由激光雷达型号决定"""
+        rings, columns, low, high = get_layout(lidar_type)
+        self.rangematrix=np.zeros((rings,columns))
+        self.index=np.zeros(rings*columns)
+        self.lablematrix=np.zeros((rings,columns),dtype=int)
+        self.groundmetrix=np.zeros(rings*columns)
         self.groundpoint=[]
-        self.startindex=np.zeros(16)
-        pass
+        self.angle_hor = 2 * math.pi / columns                      #左右相邻两格的方位角间隔
+        self.angle_ver = math.radians(high - low) / (rings - 1)     #上下相邻两线的俯仰角间隔
+        self.ground_rings = int(np.sum(np.linspace(low, high, rings) <= -7.0))   #俯仰角不高于-7度的线可能打到地面(RS16为最下面5线)
     
     def pointcloudproject(self,pcd): #range image projection
-        num,dem=pcd.shape
-        for i in range(num):
-            X=pcd[i][0]
-            Y=pcd[i][1]
-            Z=pcd[i][2]
-            #add according to the new format
-            rowID=pcd[i][3]
-            colID=pcd[i][4]
-            rowID=int(rowID) #divide vertical angle resolution
-            colID=int(colID)
-            #print(colID)
-            #print(type(rowID))
-            distance=math.sqrt(X*X+Y*Y+Z*Z)
-            if distance<1.0: #filter out point winthin 1 meter around the lidar
-                continue
-            self.rangematrix[rowID][colID]=distance #put all the range in this array
-            #pcd[i][3]=distance
-            index=colID+rowID*1800
-            #print(i)
-            if i >=28800:
-                continue
-            self.index[i]=index
-            #print(self.index)
-        #pcd=np.insert(pcd,4,values=index,axis=1)
+        """按线号, 列号把距离批量写入线数*列数的rangematrix, 1m内的点不投影, pcd为ScanFrame"""
+        rows, cols = self.rangematrix.shape
+        rowID = pcd.rings.astype(int)
+        colID = pcd.columns.astype(int)
+        xyz = pcd.points
+        distance = np.sqrt(xyz[:, 0]**2 + xyz[:, 1]**2 + xyz[:, 2]**2)
+        valid = (distance >= 1.0) & (rowID < rows) & (colID < cols) #filter out point winthin 1 meter around the lidar (and nan ranges)
+
+        self.rangematrix.fill(0)
+        self.rangematrix[rowID[valid], colID[valid]] = distance[valid] #put all the range in this array
+        self.index.fill(0)
+        self.index[(colID + rowID * cols)[valid]] = np.flatnonzero(valid)
         return pcd
     
     def markground(self,pcd): #mark ground points
-        #marker:0 no valid info, -1 initial value,after validation,not ground, 1 ground
-        for i in range(1800):
-            for j in range(4):#why 4: here we have 4 scans that are supposed to scan to the ground
-                lowerID = i * 16 + j
-                upperID = i * 16 + (j+1)
-                #print(lowerID,upperID)
-                x1=pcd[lowerID][0]
-                y1=pcd[lowerID][1]
-                z1=pcd[lowerID][2]
-                x2=pcd[upperID][0]
-                y2=pcd[upperID][1]
-                z2=pcd[upperID][2]                
-                disx=x1-x2               
-                disy=y1-y2                
-                disz=z1-z2     
-                angle=math.atan2(disz,math.sqrt(disx*disx+disy*disy))*180/math.pi               
-                if abs(angle)<=10:
-                    self.groundmetrix[upperID]=1
-                    self.groundmetrix[lowerID]=1
-                    self.groundpoint.append(lowerID)
-                #print(self.groundmetrix[upperID],self.groundmetrix[lowerID],"------------")
-        #print(self.groundmetrix)
-        return pcd, self.groundpoint
+        """相邻两线坡度在10度以内的点标为地面点, 返回点云和地面点布尔掩码
+
+        pcd为ScanFrame, 点按线号, 列号放入距离图像大小的网格, 只检查最下面ground_rings线,
+        即认为会打到地面的线, 不要求点的排列顺序.
+        """
+        n = len(pcd)
+        rows, cols = self.rangematrix.shape
+        k = self.ground_rings
+        rowID = pcd.rings.astype(int)
+        colID = pcd.columns.astype(int)
+        inside = (rowID < k) & (colID < cols)
+
+        grid = np.full((k, cols, 3), np.nan, dtype=np.float32)
+        grid[rowID[inside], colID[inside]] = pcd.points[inside]
+        dis = grid[:-1] - grid[1:]
+        with np.errstate(invalid='ignore'):
+            angle = np.degrees(np.arctan2(dis[:, :, 2], np.sqrt(dis[:, :, 0]**2 + dis[:, :, 1]**2)))
+            ground_pair = np.abs(angle) <= 10
+
+        ground = np.zeros((k, cols), dtype=bool)
+        ground[:-1] |= ground_pair
+        ground[1:] |= ground_pair
+        self.groundmetrix = np.zeros(n, dtype=bool)
+        self.groundmetrix[inside] = ground[rowID[inside], colID[inside]]
+        self.groundpoint = np.flatnonzero(self.groundmetrix)
+        return pcd, self.groundmetrix
     
-    def labelcomponents(self,row,col):
-        labelcount=1
-        self.queueIndX[0]=row
-        self.queueIndY[0]=col
-        self.allPushedIndX[0]=row
-        self.allPushedIndY[0]=col
-        list_compare=[0,0]
-        angle_hor=0.2/180*math.pi
-        angle_ver=2/180*math.pi
-        angle_bon=60/180*math.pi
-        queuesize=1
-        queuestartInd=0
-        queueendInd=1
-        allpushedindsize=1
-        while(queuesize>0):#use BFS to find the neighbor point
-            findpointIDX=self.queueIndX[queuestartInd] #find a point 
-            findpointIDY=self.queueIndY[queueendInd]
-            findpointIDX=int(findpointIDX)
-            findpointIDY=int(findpointIDY)
-            queuesize=queuesize-1
-            queuestartInd=queuestartInd+1
-            self.lablematrix[findpointIDX][findpointIDY]=labelcount #mark the poind we are going to search
-            if findpointIDX+1 <0 or findpointIDX-1<0 or findpointIDX+1>16 or findpointIDX-1>16: #index should be within the boundary
-                continue
-            if self.lablematrix[findpointIDX-1][findpointIDY]!=0:#check whether it has been coverd
-                continue
-            if self.lablematrix[findpointIDX+1][findpointIDY]!=0:#check whether it has been coverd
-                continue
-            if findpointIDY+1>=1800:
-                findpointIDY=0
-            if self.lablematrix[findpointIDX][findpointIDY+1]!=0:#check whether it has been coverd
-                continue
-            if findpointIDY-1<0:
-                findpointIDY=1800
-            if self.lablematrix[findpointIDX][findpointIDY-1]!=0:#check whether it has been coverd
-                continue
-            list_compare[0]=self.rangematrix[findpointIDX][findpointIDY] #this is the range between findpoint and lidar
-            dis_left=self.rangematrix[findpointIDX-1][findpointIDY] #use col and row id to find the range from the left point to the lidar
-            list_compare[1]=dis_left
-            d1=max(list_compare)
-            d2=min(list_compare)
-            angel=atan2(d2*sin(angle_hor),(d1-d2*cos(angle_hor)))
-            if angle>angle_bon:
-                self.queueIndX[queueendInd]=findpointIDX-1
-                self.queueIndX[queueendInd]=findpointIDY
-                queuesize=queuesize+1
-                queueendInd=queueendInd+1
-                self.lablematrix[findpointIDX-1][findpointIDY]=labelcount
-                self.allPushedIndX[allpushedindsize]=findpointIDX-1
-                self.allPushedIndY[allpushedindsize]=findpointIDY
-                allpushedindsize=allpushedindsize+1
-            dis_right=self.rangematrix[findpointIDX+1][findpointIDY] #right point
-            list_compare[1]=dis_right
-            d1=max(list_compare)
-            d2=min(list_compare)
-            angle=atan2(d2*sin(angle_hor),(d1-d2*cos(angle_hor)))
-            if angle>angle_bon:
-                self.queueIndX[queueendInd]=findpointIDX+1
-                self.queueIndX[queueendInd]=findpointIDY
-                queuesize=queuesize+1
-                queueendInd=queueendInd+1
-                self.lablematrix[findpointIDX+1][findpointIDY]=labelcount
-                self.allPushedIndX[allpushedindsize]=findpointIDX+1
-                self.allPushedIndY[allpushedindsize]=findpointIDY
-                allpushedindsize=allpushedindsize+1
-            dis_up=self.rangematrix[findpointIDX][findpointIDY+1]#uppper point
-            list_compare[1]=dis_up
-            d1=max(list_compare)
-            d2=min(list_compare)
-            angel=atan2(d2*sin(angle_ver),(d1-d2*cos(angle_ver)))
-            if angle>angle_bon:
-                self.queueIndX[queueendInd]=findpointIDX
-                self.queueIndX[queueendInd]=findpointIDY+1
-                queuesize=queuesize+1
-                queueendInd=queueendInd+1
-                self.lablematrix[findpointIDX][findpointIDY+1]=labelcount
-                self.allPushedIndX[allpushedindsize]=findpointIDX
-                self.allPushedIndY[allpushedindsize]=findpointIDY+1
-                allpushedindsize=allpushedindsize+1
-            dis_low=self.rangematrix[findpointIDX][findpointIDY-1]#lower point
-            list_compare[1]=dis_low
-            d1=max(list_compare)
-            d2=min(list_compare)
-            angel=atan2(d2*sin(angle_ver),(d1-d2*cos(angle_ver)))
-            if angle>angle_bon:
-                self.queueIndX[queueendInd]=findpointIDX
-                self.queueIndX[queueendInd]=findpointIDY-1
-                queuesize=queuesize+1
-                queueendInd=queueendInd+1
-                self.lablematrix[findpointIDX][findpointIDY-1]=labelcount
-                self.allPushedIndX[allpushedindsize]=findpointIDX
-                self.allPushedIndY[allpushedindsize]=findpointIDY-1
-                allpushedindsize=allpushedindsize+1
-        
-        check_seg=False
-        labelCounts=0
-        if allpushedindsize>=30: #check whether the cluster is valid
-            check_seg=True
-        if check_seg==True: #mark valid points
-            labelCounts+=1
-        else: #mark invalid points
-            self.lablematrix[findpointIDX-1][findpointIDY]=9
-            if findpointIDX+1<16:
-                self.lablematrix[findpointIDX+1][findpointIDY]=9
-            self.lablematrix[findpointIDX][findpointIDY-1]=9
-            self.lablematrix[findpointIDX][findpointIDY+1]=9
-        #print(self.lablematrix)
-        return self.lablematrix
+    def labelcomponents(self, exclude=None):
+        """整幅距离图像的连通域标记, 返回线数*列数的lablematrix
+
+        相邻两格(同一线左右相邻, 列号首尾相接; 同一列上下相邻)按LeGO-LOAM的角度判据
+        beta=atan2(d2*sin(alpha), d1-d2*cos(alpha)) > 60度视为同一物体, 用稀疏图的连通分量
+        一次标记全部聚类. lablematrix中0为无距离或被排除(exclude, 如地面点)的格子,
+        正数为有效聚类编号, -1为少于30个点的聚类.
+        """
+        angle_hor = self.angle_hor
+        angle_ver = self.angle_ver
+        angle_bon = 60 / 180 * math.pi
+        rows, cols = self.rangematrix.shape
+        valid = self.rangematrix > 0
+        if exclude is not None:
+            valid &= ~exclude
+        node = np.arange(rows * cols).reshape(rows, cols)
+
+        """左右相邻(列号首尾相接)"""
+        right = np.roll(self.rangematrix, -1, axis=1)
+        link_hor = valid & np.roll(valid, -1, axis=1) & (self._get_angle(self.rangematrix, right, angle_hor) > angle_bon)
+
+        """上下相邻"""
+        link_ver = valid[:-1] & valid[1:] & (self._get_angle(self.rangematrix[:-1], self.rangematrix[1:], angle_ver) > angle_bon)
 
+        src = np.concatenate((node[link_hor], node[:-1][link_ver]))
+        dst = np.concatenate((np.roll(node, -1, axis=1)[link_hor], node[1:][link_ver]))
+        graph = coo_matrix((np.ones(src.shape[0], dtype=bool), (src, dst)), shape=(rows * cols, rows * cols))
+        _, label = connected_components(graph, directed=False)
+        label = label.reshape(rows, cols)
 
-    def cloudsegmentation(self,pcd):#point cloud segmentation,to remove clusters with few points
-        for i in range(16):
-            for j in range(1800):
-                #print(j)
-                if self.lablematrix[i][j]==0: #to make labelmatrix
-                    self.labelcomponents(i,j) 
-        #print(self.lablematrix)
+        """点数少于30的聚类标为-1, 有效聚类重新从1编号"""
+        size = np.bincount(label[valid], minlength=rows * cols)
+        keep = size >= 30
+        number = np.cumsum(keep)
+        self.lablematrix = np.where(valid, np.where(keep[label], number[label], -1), 0)
         return self.lablematrix
+
+    def _get_angle(self, range_a, range_b, alpha):
+        """相邻两点的角度判据beta, 越大越可能属于同一物体"""
+        d1 = np.maximum(range_a, range_b)
+        d2 = np.minimum(range_a, range_b)
+        return np.arctan2(d2 * np.sin(alpha), d1 - d2 * np.cos(alpha))
+
+    def cloudsegmentation(self, pcd, ground=None):#point cloud segmentation,to remove clusters with few points
+        """投影并分割点云(ScanFrame), 返回点云和属于小聚类(需去除)的点的布尔掩码, ground中的点不参与分割"""
+        self.pointcloudproject(pcd)
+        rowID = pcd.rings.astype(int)
+        colID = pcd.columns.astype(int)
+        exclude = None
+        if ground is not None:
+            exclude = np.zeros(self.rangematrix.shape, dtype=bool)
+            exclude[rowID[ground], colID[ground]] = True
+
+        self.labelcomponents(exclude)
+        outlier = self.lablematrix[rowID, colID] == -1
+        return pcd, outlier
     
 class Map():
     """
@@ -544,7 +1020,7 @@ class Map():
         self.last_features = []
         self.init_flag = 0
         self.allpiont_save = []
-        self.lidar_odometry = LidarOdometry()
+        self.local_map = LocalMap(leaf_size={"edge": 0.2, "plane": 0.4, "all": 0.4})
         pass
 
     def input(self,features):
@@ -553,70 +1029,29 @@ class Map():
 
     
     def limit(self, allpiont, low_x, high_x, low_y, high_y, low_z, high_z):
-        x = np.array(allpiont[:,0])
-        y = np.array(allpiont[:,1])
-        z = np.array(allpiont[:,2])
-        scan = np.array(allpiont[:,3])
-        degree = np.array(allpiont[:,4])
-        mask = np.logical_and(np.logical_and(x>=low_x, x<=high_x), np.logical_and(y>=low_y, y<=high_y),np.logical_and(z>=low_z, z<=high_z))        
-        x = x[mask]
-        y = y[mask]
-        z = z[mask]
-        scan = scan[mask]
-        degree = degree[mask]
-
-        x = x[:,np.newaxis]
-        y = y[:,np.newaxis]
-        z = z[:,np.newaxis]
-        scan = scan[:,np.newaxis]
-        degree = degree[:,np.newaxis]
-        allpiont = np.concatenate((x,y,z,scan,degree),axis=1) 
-        return allpiont 
-
-    def output(self, allpiont, T_list):
+        return crop_box(allpiont, (low_x, low_y, low_z), (high_x, high_y, high_z))
+
+    def output(self, allpiont, pose):
+        """pose为该帧的累积位姿(4*4, 如Trajectory中的一项), 点云一次变换到地图坐标系
+
+        放入局部地图前按体素取中心降采样, 插入的代价与体素数而不是原始点数成正比.
+        """
+        leaf_size = self.local_map.leaf_size.get("all")
         if self.init_flag == 0:
-            self.allpiont_save = allpiont
+            self.local_map.insert("all", voxel_downsample(allpiont, leaf_size))
+            self.allpiont_save = self.local_map.get("all")
             self.init_flag = 1
 
         elif self.init_flag == 1:
-            print(allpiont[:,0])
-            for i in range(len(T_list)):
-                allpiont = self.lidar_odometry.transform(allpiont, T_list[-i-1])
-            #print(allpiont[:,0])
-            #print(allpiont.shape)
-
-            x = np.array(allpiont[:,0])
-            y = np.array(allpiont[:,1])
-            z = np.array(allpiont[:,2])
-            scan = np.array(allpiont[:,3])
-            degree = np.array(allpiont[:,4])
-            mask = np.logical_and(np.logical_and(x>=-100, x<=100), np.logical_and(y>=-100, y<=100),np.logical_and(z>=-100, z<=100))
-            #print(x)
-            '''
-            x = self.tomask(x)
-            y = self.tomask(y)
-            z = self.tomask(z)
-            print(x)
-            mask = np.logical_and(x==1, y==1, z==1)
-            '''
-            
-            x = x[mask]
-            y = y[mask]
-            z = z[mask]
-            scan = scan[mask]
-            degree = degree[mask]
-
-            x = x[:,np.newaxis]
-            #print(x.shape)
-            y = y[:,np.newaxis]
-            z = z[:,np.newaxis]
-            scan = scan[:,np.newaxis]
-            degree = degree[:,np.newaxis]
-            allpiont = np.concatenate((x,y,z,scan,degree),axis=1) 
-            #print(allpiont)
-            print(allpiont.shape)
-            
-            self.allpiont_save = np.append(self.allpiont_save,allpiont,axis=0)
+            xyz = transform_points(allpiont, pose)
+            mask = crop_box(xyz, pose[:3, 3] - 100, pose[:3, 3] + 100, return_mask=True)
+            allpiont = np.concatenate((xyz[mask], allpiont[mask, 3:]), axis=1)    #只复制范围内的点的标签列
+            allpiont = voxel_downsample(allpiont, leaf_size)
+
+            """放入局部地图, 删除远离当前位置的立方体"""
+            self.local_map.insert("all", allpiont)
+            self.local_map.evict(pose[:3, 3])
+            self.allpiont_save = self.local_map.get("all")
         return self.allpiont_save  
         
 
@@ -629,7 +1064,9 @@ class Map():
         if self.init_flag == 0:
             self.last_features = features
             self.init_flag = 1
-            self.last_edge_points = self.last_features[0] 
+            self.local_map.insert("edge", features[0])
+            self.local_map.insert("plane", features[1])
+            self.last_edge_points = self.local_map.get("edge")
 
         elif self.init_flag == 1:
             self.transformAssociateToMap(features)
@@ -640,21 +1077,100 @@ class Map():
         self.edge_points = features[0]  #(1xxx, 5)
         self.plane_points = features[1] #(1xxx, 5)
 
-        self.last_edge_points = self.last_features[0]  #(1xxx, 5)
-        self.last_plane_points = self.last_features[1]
-
         #处理的代码
-        self.last_edge_points = np.append(self.edge_points,self.last_edge_points,axis=0)
+        self.local_map.insert("edge", self.edge_points)
+        self.local_map.insert("plane", self.plane_points)
+        self.last_edge_points = self.local_map.get("edge")
+        self.last_plane_points = self.local_map.get("plane")
         self.last_features[0] = self.last_edge_points
-        self.last_plane_points = np.append(self.plane_points,self.last_plane_points,axis=0)
         self.last_features[1] = self.last_plane_points
-    '''
-    def fk():
-        self.laserCloudCenWidth = 10 #邻域宽度, cm为单位
-        self.laserCloudCenHeight = 5 #邻域高度
-        self.laserCloudCenDepth = 10 #邻域深度
-        self.laserCloudWidth = 21   #子cube沿宽方向的分割个数
-        self.laserCloudHeight = 11  #高方向个数
-        self.laserCloudDepth = 21   #深度方向个数
-        self.laserCloudNum = self.laserCloudWidth * self.laserCloudHeight * self.laserCloudDepth   #子cube总数    
-    '''
\ No newline at end of file
+
+
+class LocalMap():
+    """
+    体素哈希局部地图(对应LOAM的21*11*21子cube)
+
+    按cube_size把空间划分为立方体, 以整数坐标(i, j, k)为键; 每个立方体内各层点云
+    按leaf_size体素降采样, 只保留当前位置radius范围内的立方体, 内存不随运行时间增长.
+    每层记下已占用体素的哈希键, 插入时只对新点查表, 代价与新点数成正比, 与立方体中已有的点数无关.
+    """
+    def __init__(self, cube_size=10.0, radius=100.0, leaf_size=None):
+        self.cube_size = cube_size
+        self.radius = radius
+        self.leaf_size = {"edge": 0.2, "plane": 0.4} if leaf_size is None else leaf_size
+        self.cubes = {}     #(i, j, k) -> {层名: {"points": 点云块列表, "voxels": 已占用体素的哈希键集合}}
+        self.columns = {}   #层名 -> 点云列数
+
+    def cube_index(self, point):
+        """点所在立方体的键"""
+        return tuple(np.floor(np.asarray(point)[:3] / self.cube_size).astype(int))
+
+    def insert(self, name, points):
+        """按立方体分组插入, 每个立方体只处理一次
+
+        每个leaf_size体素保留最先插入的一个点: 新点先在本批内按体素去重, 再去掉立方体中已占用的体素,
+        已在地图中的点不被新点挤掉.
+        """
+        self.columns[name] = points.shape[1]
+        if points.shape[0] == 0:
+            return
+
+        leaf_size = self.leaf_size.get(name)
+        if leaf_size is not None:
+            keys = voxel_keys(points, leaf_size)
+            _, first = np.unique(keys, return_index=True)
+            first.sort()
+            points, keys = points[first], keys[first]
+
+        cube_keys, inverse = np.unique(np.floor(points[:, :3] / self.cube_size).astype(np.int64), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(cube_keys.shape[0] + 1))
+
+        for n, key in enumerate(map(tuple, cube_keys.tolist())):
+            index = order[bounds[n]:bounds[n + 1]]
+            layer = self.cubes.setdefault(key, {}).setdefault(name, {"points": [], "voxels": set()})
+            if leaf_size is not None:
+                new_keys = keys[index].tolist()
+                voxels = layer["voxels"]
+                new = np.fromiter((k not in voxels for k in new_keys), dtype=bool, count=len(new_keys))
+                index = index[new]
+                voxels.update(k for k, keep in zip(new_keys, new) if keep)
+            if index.shape[0]:
+                layer["points"].append(points[index])
+
+    def evict(self, position):
+        """删除中心距position超过radius的立方体, 全部立方体的距离一次计算"""
+        if len(self.cubes) == 0:
+            return
+        keys = list(self.cubes.keys())
+        center = (np.array(keys, dtype=float) + 0.5) * self.cube_size
+        far = np.linalg.norm(center - np.asarray(position)[:3], axis=1) > self.radius
+        for n in np.flatnonzero(far):
+            del self.cubes[keys[n]]
+
+    def get(self, name, position=None, extent=None):
+        """取出一层点云; 给定position时只取其所在立方体周围extent个立方体内的点"""
+        if position is None:
+            keys = self.cubes.keys()
+        else:
+            i, j, k = self.cube_index(position)
+            keys = [(i + di, j + dj, k + dk)
+                    for di in range(-extent, extent + 1)
+                    for dj in range(-extent, extent + 1)
+                    for dk in range(-extent, extent + 1)]
+
+        points = [self._merge(self.cubes[key][name]) for key in keys if key in self.cubes and name in self.cubes[key]]
+        points = [p for p in points if p is not None]
+        if len(points) == 0:
+            return np.zeros((0, self.columns.get(name, 3)))
+
+        return np.concatenate(points)
+
+    def _merge(self, layer):
+        """把一层中多次插入的点云块合并为一块(读取时才合并), 没有点时返回None"""
+        chunks = layer["points"]
+        if len(chunks) > 1:
+            chunks[:] = [np.concatenate(chunks)]
+
+        return chunks[0] if chunks else None
@@ -0,0 +1,209 @@
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+
+"""PointField类型(INT8=1, UINT8=2, ..., FLOAT64=8)对应的numpy格式"""
+_DATATYPES = {
+    1: 'i1',
+    2: 'u1',
+    3: 'i2',
+    4: 'u2',
+    5: 'i4',
+    6: 'u4',
+    7: 'f4',
+    8: 'f8',
+}
+
+"""激光雷达型号对应的线数, 每圈列数和垂直视场(度)"""
+_LIDAR_LAYOUTS = {
+    "RS16": (16, 1800, -15.0, 15.0),
+    "RS32": (32, 1800, -25.0, 15.0),
+    "RS128": (128, 1800, -25.0, 15.0),
+}
+
+
+def get_layout(lidar_type):
+    """型号对应的(线数, 每圈列数, 最低俯仰角, 最高俯仰角), 不支持的型号抛出ValueError"""
+    if lidar_type not in _LIDAR_LAYOUTS:
+        raise ValueError("不支持的激光雷达型号%r, 支持: %s" % (lidar_type, ", ".join(_LIDAR_LAYOUTS)))
+
+    return _LIDAR_LAYOUTS[lidar_type]
+
+
+class PointCloudDecoder():
+    """
+    PointCloud2解析和线号, 列号标注, 不依赖ROS, 离线处理和测试中也可使用
+    """
+    def __init__(self, lidar_type="RS16"):
+        self.lidar_type = lidar_type
+        self.rings, self.columns, self.low, self.high = get_layout(lidar_type)
+        self.label_cache = {}
+
+    def decode(self, cloud):
+        """解析一帧, 返回(坐标, 线号, 列号, 相对时间); 有逐点时间字段时换算为帧内相对时间, 否则为None"""
+        xyz = self.read_points(cloud)
+        scan_mat, degree_mat = self.label(xyz)
+
+        relative_time = None
+        time_field = [field.name for field in cloud.fields if field.name in ("timestamp", "time", "t")]
+        if time_field:
+            point_time = self.read_points(cloud, time_field[:1], dtype=np.float64)[:, 0]
+            start, end = np.nanmin(point_time), np.nanmax(point_time)
+            relative_time = (point_time - start) / (end - start) if end > start else None
+
+        return xyz, scan_mat, degree_mat, relative_time
+
+    def label(self, pcn):
+        """计算点云的线号(uint8)和列号(uint16)
+
+        点数为线数整数倍时按列排列(每列一次发射的所有线), 线号和列号只随(型号, 点数)变化,
+        计算一次后缓存; 否则按俯仰角和方位角逐帧批量计算.
+        """
+        n = pcn.shape[0]
+        rings = self.rings
+        key = (self.lidar_type, n)
+        if key not in self.label_cache:
+            if n % rings == 0:
+                self.label_cache[key] = self._get_label_table(pcn)
+            else:
+                key = None
+
+        if key is None:
+            scan_mat, degree_mat = self._get_label_angle(pcn)
+        else:
+            scan_mat, degree_mat = self.label_cache[key]
+
+        return scan_mat, degree_mat
+
+    def _get_label_table(self, pcn):
+        """按列排列的点云的线号和列号表
+
+        RS16按固定的发射顺序, 其他型号按第一帧中每个发射通道俯仰角的中位数排序得到线号.
+        """
+        n = pcn.shape[0]
+        rings = self.rings
+        laser = np.arange(n) % rings
+        if self.lidar_type == "RS16":
+            order = np.where(laser < 9, laser, 24 - laser)
+        else:
+            elevation = np.arctan2(pcn[:, 2], np.hypot(pcn[:, 0], pcn[:, 1])).reshape(-1, rings)
+            rank = np.argsort(np.argsort(np.nanmedian(elevation, axis=0)))
+            order = rank[laser]
+
+        return order.astype(np.uint8), (np.arange(n) // rings).astype(np.uint16)
+
+    def _get_label_angle(self, pcn):
+        """按俯仰角(均匀分布在垂直视场内)和方位角计算线号和列号"""
+        rings, columns, low, high = self.rings, self.columns, self.low, self.high
+        elevation = np.degrees(np.arctan2(pcn[:, 2], np.hypot(pcn[:, 0], pcn[:, 1])))
+        azimuth = np.degrees(np.arctan2(pcn[:, 1], pcn[:, 0])) % 360
+        with np.errstate(invalid='ignore'):
+            scan_mat = np.clip(np.rint((elevation - low) / (high - low) * (rings - 1)), 0, rings - 1)
+            degree_mat = np.minimum(np.floor(azimuth / 360 * columns), columns - 1)
+
+        return np.nan_to_num(scan_mat).astype(np.uint8), np.nan_to_num(degree_mat).astype(np.uint16)
+
+    def read_points(self, cloud, field_names=("x", "y", "z"), skip_nans=False, dtype=np.float32):
+        """读取点云数据, 返回N*k的数组(默认float32, 时间戳等需要精度时用float64)"""
+        struct_dtype = self._get_struct_dtype(cloud.is_bigendian, cloud.fields, cloud.point_step)
+
+        """按point_step/row_step直接映射data, 不逐点解析"""
+        points = np.ndarray(shape=(cloud.height, cloud.width), dtype=struct_dtype, buffer=cloud.data,
+                            strides=(cloud.row_step, cloud.point_step)).reshape(-1)
+
+        if field_names is None:
+            field_names = struct_dtype.names
+        points = structured_to_unstructured(points[list(field_names)], dtype=dtype)
+
+        if skip_nans:
+            points = points[~np.isnan(points).any(axis=1)]
+
+        return points
+
+    def _get_struct_dtype(self, is_bigendian, fields, point_step):
+        """根据fields获取数据格式(偏移, 类型, 字节序, 填充)"""
+        byteorder = '>' if is_bigendian else '<'
+
+        names, formats, offsets = [], [], []
+        for field in sorted(fields, key=lambda f: f.offset):
+            datatype_fmt = _DATATYPES[field.datatype]
+            names.append(field.name)
+            formats.append((byteorder + datatype_fmt, (field.count,)) if field.count > 1 else byteorder + datatype_fmt)
+            offsets.append(field.offset)
+
+        return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': point_step})
+
+
+class Rs16MsopDecoder():
+    """
+    RS16 MSOP数据包(1248字节)解析, 按方位角拼成一帧
+
+    每包12个数据块, 每块为方位角和两次发射(各16线)的距离. 垂直角取标称值(第i通道-15+2i度),
+    输出与rslidar_sdk相同的有序点云: 1800列*16点, 每列内的点顺序与PointCloudDecoder的RS16发射顺序一致,
+    无回波的点为nan.
+    """
+    def __init__(self, distance_resolution=0.005, columns=1800):
+        self.distance_resolution = distance_resolution
+        self.columns = columns
+        self.vertical = np.radians(-15.0 + 2.0 * np.arange(16))
+        laser = np.arange(16)
+        self.order = np.where(laser < 9, laser, 24 - laser)     #列内第k个点对应的通道
+        self.azimuth = []
+        self.distance = []
+        self.last_azimuth = None
+
+    def feed(self, packet):
+        """输入一个数据包, 方位角回绕(一圈结束)时返回该帧n*3的float32坐标, 否则返回None"""
+        blocks = np.frombuffer(packet, dtype=np.uint8, count=1200, offset=42).reshape(12, 100)
+        blocks = blocks[(blocks[:, 0] == 0xff) & (blocks[:, 1] == 0xee)]
+        if blocks.shape[0] == 0:
+            return None
+
+        azimuth = (blocks[:, 2].astype(np.uint16) << 8 | blocks[:, 3]) / 100.0
+        channel = blocks[:, 4:].reshape(-1, 32, 3)
+        distance = (channel[:, :, 0].astype(np.uint16) << 8 | channel[:, :, 1]) * self.distance_resolution
+
+        """第二次发射的方位角取相邻两块的中点"""
+        step = np.diff(azimuth) % 360
+        step = np.append(step, step[-1] if step.shape[0] else 0.0)
+        azimuth = np.stack((azimuth, (azimuth + step / 2) % 360), axis=1).reshape(-1)
+        distance = distance.reshape(-1, 16)
+
+        frame = None
+        wrap = np.flatnonzero(np.diff(np.concatenate(([self.last_azimuth if self.last_azimuth is not None else azimuth[0]], azimuth))) < 0)
+        if wrap.shape[0]:
+            cut = wrap[0]
+            self.azimuth.append(azimuth[:cut])
+            self.distance.append(distance[:cut])
+            frame = self._get_frame()
+            azimuth, distance = azimuth[cut:], distance[cut:]
+
+        self.azimuth.append(azimuth)
+        self.distance.append(distance)
+        self.last_azimuth = azimuth[-1]
+
+        return frame
+
+    def flush(self):
+        """返回尚未输出的最后一帧(数据结束时调用), 没有时返回None"""
+        if not self.azimuth:
+            return None
+        return self._get_frame()
+
+    def _get_frame(self):
+        """把累积的列按方位角放入1800*16的有序点云"""
+        azimuth = np.radians(np.concatenate(self.azimuth))
+        distance = np.concatenate(self.distance)
+        self.azimuth, self.distance = [], []
+
+        distance = np.where(distance > 0, distance, np.nan)[:, self.order]
+        vertical = self.vertical[self.order]
+        xyz = np.stack((distance * np.cos(vertical) * np.cos(azimuth)[:, np.newaxis],
+                        -distance * np.cos(vertical) * np.sin(azimuth)[:, np.newaxis],
+                        distance * np.sin(vertical)), axis=2)
+
+        grid = np.full((self.columns, 16, 3), np.nan, dtype=np.float32)
+        column = np.floor(np.degrees(azimuth) / 360 * self.columns + 1e-6).astype(int) % self.columns
+        grid[column] = xyz
+
+        return grid.reshape(-1, 3)
@@ -0,0 +1,69 @@
+"""
+点云滤波: 裁剪, 体素降采样, 随机/均匀抽样
+
+输入均为n*k数组, 前3列为坐标, 其余列(线号, 列号等)随点保留.
+"""
+import numpy as np
+
+
+"""体素坐标打包为int64哈希键, 每轴21位, 覆盖+-2^20个体素"""
+_VOXEL_BITS = 21
+_VOXEL_OFFSET = 1 << (_VOXEL_BITS - 1)
+
+
+def crop_box(points, low, high, return_mask=False):
+    """保留low <= xyz <= high(逐轴)的点, 一次比较三轴
+
+    low, high为3维; return_mask为True时返回掩码, 供ScanFrame等按同一掩码取其他列.
+    """
+    low = np.asarray(low, dtype=points.dtype)
+    high = np.asarray(high, dtype=points.dtype)
+    center, half = (low + high) / 2, (high - low) / 2
+    mask = (np.abs(points[:, :3] - center) <= half).all(axis=1)
+
+    return mask if return_mask else points[mask]
+
+
+def voxel_keys(points, leaf_size):
+    """各点所在体素的int64哈希键"""
+    voxel = np.floor(points[:, :3] / leaf_size).astype(np.int64) + _VOXEL_OFFSET
+    np.clip(voxel, 0, (1 << _VOXEL_BITS) - 1, out=voxel)
+
+    return (voxel[:, 0] << (2 * _VOXEL_BITS)) | (voxel[:, 1] << _VOXEL_BITS) | voxel[:, 2]
+
+
+def voxel_downsample(points, leaf_size, reduce="centroid"):
+    """体素降采样, 每个体素保留一个点
+
+    reduce为"centroid"时坐标取体素内的均值, 其他列取体素内最先出现的点;
+    为"first"时保留最先出现的点. 输出按各体素最先出现的顺序排列.
+    """
+    if points.shape[0] == 0 or leaf_size is None:
+        return points
+
+    _, first, inverse, counts = np.unique(voxel_keys(points, leaf_size), return_index=True, return_inverse=True, return_counts=True)
+    order = np.argsort(first, kind="stable")
+    out = points[first[order]]
+    if reduce == "centroid":
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        inverse = rank[inverse.reshape(-1)]
+        for axis in range(3):
+            out[:, axis] = np.bincount(inverse, weights=points[:, axis], minlength=out.shape[0]) / counts[order]
+
+    return out
+
+
+def random_subsample(points, n, rng=None):
+    """不放回随机抽取n个点, 保持原顺序"""
+    if points.shape[0] <= n:
+        return points
+    rng = np.random.default_rng() if rng is None else rng
+    index = np.sort(rng.choice(points.shape[0], n, replace=False))
+
+    return points[index]
+
+
+def uniform_subsample(points, step):
+    """每step个点取一个, 返回视图"""
+    return points[::max(int(step), 1)]
@@ -0,0 +1,62 @@
+import numpy as np
+
+import sys,os
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+
+from lie import matrix_to_euler, so3_exp, so3_log
+from sensor_buffer import StreamBuffer
+
+
+class ImuPreintegration():
+    """
+    IMU预积分, 为激光里程计提供两帧之间的初值
+
+    角速度按零阶保持积分得到两帧之间的旋转; 速度积分需要重力方向和零偏,
+    这里平移沿用上一帧的结果(匀速假设).
+    """
+    def __init__(self, buffer=None, capacity=2000):
+        """buffer为IMU数据流(角速度, 加速度共6维), 可与其他模块共用"""
+        self.buffer = StreamBuffer(6, capacity) if buffer is None else buffer
+
+    def put(self, stamp, rate, acc=(0.0, 0.0, 0.0)):
+        return self.buffer.put(stamp, (*rate, *acc))
+
+    def integrate(self, t0, t1):
+        """t0到t1之间的旋转矩阵(t1时刻坐标系到t0时刻坐标系), 数据不覆盖该区间时返回None"""
+        stamp, value = self.buffer.window(t0, t1)
+        if stamp.shape[0] == 0 or stamp[0] > t0 or stamp[-1] < t1 - 0.05 or t1 <= t0:
+            return None
+
+        """积分区间按数据时刻切分, 每段用两端插值角速度的均值(梯形), t1晚于最新数据时沿用最新的角速度"""
+        last = np.searchsorted(stamp, t1, side='left')
+        knots = np.concatenate(([t0], stamp[1:last], [t1]))
+        rate = self.buffer.interpolate(np.minimum(knots, stamp[-1]))[:, :3]
+        rotvec = (rate[:-1] + rate[1:]) / 2 * np.diff(knots)[:, np.newaxis]
+
+        R = np.eye(3)
+        for dR in so3_exp(rotvec):
+            R = R @ dR
+
+        return R
+
+    def mean_rate(self, t0, t1):
+        """t0到t1之间的平均角速度, 数据不覆盖该区间时返回None"""
+        R = self.integrate(t0, t1)
+        if R is None:
+            return None
+
+        return so3_log(R) / (t1 - t0)
+
+    def get_T(self, t0, t1, T_last=None):
+        """两帧之间的里程计初值T(当前帧到上一帧), 旋转由IMU积分, 平移取上一帧结果"""
+        R = self.integrate(t0, t1)
+        if R is None:
+            return None
+
+        T = np.zeros(6)
+        T[:3] = matrix_to_euler(R)
+        if T_last is not None:
+            T[3:] = T_last[3:]
+
+        return T
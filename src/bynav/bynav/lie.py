@@ -0,0 +1,199 @@
+"""
+SO(3)/SE(3)的批量运算, 所有函数都支持前置的批量维度(如n*3旋转向量, n*4*4位姿)
+
+旋转向量/李代数的排列与里程计的T一致: 先旋转后平移, xi = [phi, rho].
+位姿为4*4齐次矩阵, 欧拉角T = [alpha, beta, gamma, x, y, z]对应R = Rx*Ry*Rz.
+"""
+import numpy as np
+
+
+def hat(v):
+    """向量的反对称矩阵, (..., 3) -> (..., 3, 3)"""
+    v = np.asarray(v)
+    K = np.zeros(v.shape + (3,), dtype=np.result_type(v, np.float32))
+    K[..., 0, 1], K[..., 0, 2], K[..., 1, 2] = -v[..., 2], v[..., 1], -v[..., 0]
+    K[..., 1, 0], K[..., 2, 0], K[..., 2, 1] = v[..., 2], -v[..., 1], v[..., 0]
+
+    return K
+
+
+def _get_coefficients(theta):
+    """sin(t)/t, (1-cos(t))/t^2, (t-sin(t))/t^3, 小角度时用泰勒展开"""
+    small = theta < 1e-4
+    t = np.where(small, 1.0, theta)
+    t2 = theta * theta
+    A = np.where(small, 1 - t2 / 6, np.sin(t) / t)
+    B = np.where(small, 0.5 - t2 / 24, (1 - np.cos(t)) / (t * t))
+    C = np.where(small, 1 / 6 - t2 / 120, (t - np.sin(t)) / (t * t * t))
+
+    return A, B, C
+
+
+def _get_hat2(v):
+    """hat(v)^2 = v*v^T - |v|^2*I, 不做批量矩阵乘法"""
+    K2 = v[..., :, np.newaxis] * v[..., np.newaxis, :]
+    diagonal = np.einsum("...ii->...i", K2)
+    diagonal -= np.einsum("...i,...i->...", v, v)[..., np.newaxis]
+
+    return K2
+
+
+def so3_exp(rotvec):
+    """旋转向量转旋转矩阵(Rodrigues), (..., 3) -> (..., 3, 3)"""
+    rotvec = np.asarray(rotvec)
+    theta = np.linalg.norm(rotvec, axis=-1)
+    A, B, _ = _get_coefficients(theta)
+    R = B[..., np.newaxis, np.newaxis] * _get_hat2(rotvec)
+    R += A[..., np.newaxis, np.newaxis] * hat(rotvec)
+    np.einsum("...ii->...i", R)[...] += 1
+
+    return R
+
+
+def rotate_points(rotvec, points):
+    """每个点按各自的旋转向量旋转(Rodrigues), rotvec和points均为n*3, 不构造n个旋转矩阵"""
+    theta = np.linalg.norm(rotvec, axis=-1)
+    A, B, _ = _get_coefficients(theta)
+    w_p = np.cross(rotvec, points)
+
+    return points + A[..., np.newaxis] * w_p + B[..., np.newaxis] * np.cross(rotvec, w_p)
+
+
+def so3_log(R):
+    """旋转矩阵转旋转向量, (..., 3, 3) -> (..., 3), 转角接近pi时由对角线求转轴"""
+    R = np.asarray(R)
+    cos = np.clip((np.trace(R, axis1=-2, axis2=-1) - 1) / 2, -1, 1)
+    theta = np.arccos(cos)
+    v = np.stack((R[..., 2, 1] - R[..., 1, 2], R[..., 0, 2] - R[..., 2, 0], R[..., 1, 0] - R[..., 0, 1]), axis=-1)
+
+    sin = np.sin(theta)
+    small = theta < 1e-4
+    scale = np.where(small, 0.5 + theta * theta / 12, theta / (2 * np.where(small, 1, sin)))
+    rotvec = v * scale[..., np.newaxis]
+
+    near_pi = theta > np.pi - 1e-3
+    if np.any(near_pi):
+        """对称部分(R + R^T)/2 = cos*I + (1-cos)*k*k^T, 取对角线最大的一列为转轴, 符号由反对称部分确定"""
+        c = cos[near_pi][:, np.newaxis, np.newaxis]
+        S = ((R[near_pi] + np.swapaxes(R[near_pi], -1, -2)) / 2 - c * np.eye(3)) / (1 - c)
+        i = np.argmax(np.diagonal(S, axis1=-2, axis2=-1), axis=-1)
+        k = S[np.arange(S.shape[0]), :, i] / np.sqrt(np.maximum(S[np.arange(S.shape[0]), i, i], 1e-12))[:, np.newaxis]
+        sign = np.where(np.einsum("ni,ni->n", k, v[near_pi]) < 0, -1, 1)
+        rotvec[near_pi] = k * (sign * theta[near_pi])[:, np.newaxis]
+
+    return rotvec
+
+
+def se3_exp(xi):
+    """李代数[phi, rho]转位姿, (..., 6) -> (..., 4, 4)"""
+    xi = np.asarray(xi, dtype=float)
+    phi, rho = xi[..., :3], xi[..., 3:]
+    theta = np.linalg.norm(phi, axis=-1)
+    A, B, C = _get_coefficients(theta)
+    K = hat(phi)
+    K2 = _get_hat2(phi)
+
+    M = np.zeros(xi.shape[:-1] + (4, 4))
+    M[..., :3, :3] = np.eye(3) + A[..., np.newaxis, np.newaxis] * K + B[..., np.newaxis, np.newaxis] * K2
+    V = np.eye(3) + B[..., np.newaxis, np.newaxis] * K + C[..., np.newaxis, np.newaxis] * K2
+    M[..., :3, 3] = np.einsum("...ij,...j->...i", V, rho)
+    M[..., 3, 3] = 1
+
+    return M
+
+
+def se3_log(M):
+    """位姿转李代数[phi, rho], (..., 4, 4) -> (..., 6)"""
+    M = np.asarray(M)
+    phi = so3_log(M[..., :3, :3])
+    theta = np.linalg.norm(phi, axis=-1)
+    A, B, _ = _get_coefficients(theta)
+    small = theta < 1e-4
+    t2 = np.where(small, 1.0, theta * theta)
+    D = np.where(small, 1 / 12 + theta * theta / 720, (1 - A / (2 * np.where(small, 1, B))) / t2)
+    K = hat(phi)
+    V_inv = np.eye(3) - 0.5 * K + D[..., np.newaxis, np.newaxis] * _get_hat2(phi)
+
+    return np.concatenate((phi, np.einsum("...ij,...j->...i", V_inv, M[..., :3, 3])), axis=-1)
+
+
+def euler_to_matrix(T):
+    """欧拉角位姿[alpha, beta, gamma, x, y, z]转4*4矩阵, (..., 6) -> (..., 4, 4)"""
+    T = np.asarray(T, dtype=float)
+    sa, ca = np.sin(T[..., 0]), np.cos(T[..., 0])
+    sb, cb = np.sin(T[..., 1]), np.cos(T[..., 1])
+    sg, cg = np.sin(T[..., 2]), np.cos(T[..., 2])
+
+    M = np.zeros(T.shape[:-1] + (4, 4))
+    M[..., 0, 0], M[..., 0, 1], M[..., 0, 2] = cb * cg, -cb * sg, sb
+    M[..., 1, 0], M[..., 1, 1], M[..., 1, 2] = sa * sb * cg + ca * sg, ca * cg - sa * sb * sg, -sa * cb
+    M[..., 2, 0], M[..., 2, 1], M[..., 2, 2] = sa * sg - ca * sb * cg, sa * cg + ca * sb * sg, ca * cb
+    M[..., :3, 3] = T[..., 3:6]
+    M[..., 3, 3] = 1
+
+    return M
+
+
+def matrix_to_euler(R):
+    """旋转矩阵(或4*4位姿的旋转部分)转欧拉角[alpha, beta, gamma], (..., 3, 3) -> (..., 3)"""
+    R = np.asarray(R)
+    alpha = np.arctan2(-R[..., 1, 2], R[..., 2, 2])
+    beta = np.arcsin(np.clip(R[..., 0, 2], -1, 1))
+    gamma = np.arctan2(-R[..., 0, 1], R[..., 0, 0])
+
+    return np.stack((alpha, beta, gamma), axis=-1)
+
+
+def compose(A, B):
+    """位姿复合A*B"""
+    return np.matmul(A, B)
+
+
+def inverse(M):
+    """位姿求逆, 旋转部分转置"""
+    M = np.asarray(M)
+    out = np.zeros(M.shape)
+    R_T = np.swapaxes(M[..., :3, :3], -1, -2)
+    out[..., :3, :3] = R_T
+    out[..., :3, 3] = -np.einsum("...ij,...j->...i", R_T, M[..., :3, 3])
+    out[..., 3, 3] = 1
+
+    return out
+
+
+def interpolate(A, B, s):
+    """A到B之间按比例s插值(s可以是数组, 可以超出[0, 1]外推)
+
+    旋转沿测地线插值, 平移线性插值, 与匀速运动模型一致. s为n维时返回n*4*4.
+    """
+    A, B = np.asarray(A, dtype=float), np.asarray(B, dtype=float)
+    s = np.asarray(s, dtype=float)
+    R_A = A[..., :3, :3]
+    rotvec = so3_log(np.swapaxes(R_A, -1, -2) @ B[..., :3, :3])
+
+    M = np.zeros(s.shape + (4, 4))
+    M[..., :3, :3] = R_A @ so3_exp(s[..., np.newaxis] * rotvec)
+    M[..., :3, 3] = A[..., :3, 3] + s[..., np.newaxis] * (B[..., :3, 3] - A[..., :3, 3])
+    M[..., 3, 3] = 1
+
+    return M
+
+
+def transform_points(points, M, out=None):
+    """位姿变换点云的坐标列(前3列), 不复制其他列(线号, 列号等)
+
+    M为4*4(整体变换)或n*4*4(逐点变换). 默认返回新的n*3坐标数组, 标签列由调用方按引用
+    使用points[:, 3:]; 给定out时把坐标写入out[:, :3]并返回out, out=points即原地变换.
+    计算精度与points一致(float32或float64).
+    """
+    M = np.asarray(M, dtype=np.result_type(points.dtype, np.float32))
+    xyz = points[:, :3]
+    if M.ndim == 2:
+        xyz = xyz @ M[:3, :3].T + M[:3, 3]
+    else:
+        xyz = np.einsum("nij,nj->ni", M[:, :3, :3], xyz) + M[:, :3, 3]
+    if out is None:
+        return xyz
+
+    out[:, :3] = xyz
+    return out
@@ -1,11 +1,19 @@
 import time
 import math
+import threading
 import rclpy
 from rclpy.node import Node
+from rclpy.time import Time
 from serial import Serial
 from sensor_msgs.msg import Imu
 from sensor_msgs.msg import NavSatFix
 
+import sys,os
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+
+from novatel import GpsClock, NovatelParser
+
 
 class Node_bynav(Node):
     """
@@ -17,22 +25,27 @@ class Node_bynav(Node):
 
         """创建并初始化发布"""
         self.gps_pub = self.create_publisher(NavSatFix,"gps", 10) 
-        self.imu_pub = self.create_publisher(Imu,"imu", 10) 
-
-        timer_period = 0.01
-        self.timer = self.create_timer(timer_period, self.timer_callback)
+        self.imu_pub = self.create_publisher(Imu,"imu", 100) 
 
         """打开串口"""
-        port = "/dev/ttyUSB0"
-        baudrate = 115200
-        self.ser = Serial(port, baudrate)
+        self.declare_parameter("port", "/dev/ttyUSB0")
+        self.declare_parameter("baudrate", 115200)
+        port = self.get_parameter("port").value
+        baudrate = self.get_parameter("baudrate").value
+        self.ser = Serial(port, baudrate, timeout=0.01)
+        self.byte_time = 10 / baudrate      #每字节8位数据加起止位
 
         self.get_logger().info("串口已打开")
 
         self.gps_msg = NavSatFix()
         self.imu_msg = Imu()
-        self.gps_flag = 0
-        self.imu_flag = 0
+
+        """独立线程读取串口, 每条数据收到即发布"""
+        self.parser = NovatelParser()
+        self.clock = GpsClock()
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
 
     def Eular2Quat(self, EularAngle_list):
         """欧拉角转四元数"""
@@ -54,157 +67,51 @@ class Node_bynav(Node):
         
         return Quat_list
 
-    def timer_callback(self):
-        """读取解析数据"""
-        line = self.ser.readline()
-        line = str(line)
-        #line = "#RAWIMUA,ICOM4,0,0.0,FINESTEERING,2107,37454.000,00000000,0000,68;2107,37454.000000000,00000000,-2116037,15254,-3991,1707,2161,3258*ab408b44"
-        line = str(line)
-        list = line.split(',')
-
-        """gps数据"""
-        if str(list[0]) == "$GPGGA":
-            if list[1] != "":
-                self.gps_msg.latitude = float(list[2])/100
-                self.gps_msg.longitude = float(list[4])/100
-                self.gps_msg.altitude = float(list[9])
-
-                self.gps_flag = 1
-
-            else:
-                self.gps_flag = 0
-
-        elif str(list[0]) == "b'#RAWIMUA":
-            """imu校正数据"""
-            header, list = line.split(';')
-            list = list.split(',')
-
-            if list[1] != "":
-                PitchRate = float((list[8].split('*'))[0])
-                RollRate = -float(list[7])
-                YawRate = float(list[6])
-                LateralAcc = float(list[5])
-                LongitudinalAcc = -float(list[4])
-                VerticalAcc = float(list[3])
-
-                
-                PitchRate *= 3.0517578125e-05
-                RollRate *= 3.0517578125e-05
-                YawRate *= 3.0517578125e-05
-                LateralAcc *= 3.74094e-06
-                LongitudinalAcc *= 3.74094e-06
-                VerticalAcc *= 3.74094e-06
-
-                self.imu_msg.angular_velocity.x = PitchRate
-                self.imu_msg.angular_velocity.y = RollRate
-                self.imu_msg.angular_velocity.z = YawRate
-
-                self.imu_msg.linear_acceleration.x = LateralAcc
-                self.imu_msg.linear_acceleration.y = LongitudinalAcc
-                self.imu_msg.linear_acceleration.z = VerticalAcc
-
-                self.imu_flag = 1
-
-            else:
-                self.imu_flag = 0
-
-        """发布数据"""
-        if(self.imu_flag == 1):
-            self.imu_msg.header.stamp = self.get_clock().now().to_msg()
+    def read_loop(self):
+        """按块读取串口字节流, 增量解析
+
+        每块数据记下收到的时间, 块中各消息按字节位置倒推收到时间; 带GPS时间的消息(IMU, 姿态)
+        再按GPS时间换算, 同一块中的消息时间戳各不相同.
+        """
+        while self.running:
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if not data:
+                continue
+            now = self.get_clock().now().nanoseconds * 1e-9
+            for message in self.parser.feed(data, now, self.byte_time):
+                stamp = self.clock.stamp(message)
+                message["stamp"] = Time(nanoseconds=int(round(stamp * 1e9))).to_msg()
+                self.publish(message)
+
+    def publish(self, message):
+        """发布一条解析后的数据"""
+        if message["type"] == "RAWIMU":
+            """imu原始数据, 姿态取最近一次INSATT"""
+            self.imu_msg.header.stamp = message["stamp"]
+            (self.imu_msg.angular_velocity.x, self.imu_msg.angular_velocity.y,
+             self.imu_msg.angular_velocity.z) = message["rate"]
+            (self.imu_msg.linear_acceleration.x, self.imu_msg.linear_acceleration.y,
+             self.imu_msg.linear_acceleration.z) = message["acc"]
             self.imu_pub.publish(self.imu_msg)
-            self.get_logger().info("发布imu消息")
-        elif(self.imu_flag == 0):
-            self.imu_pub.publish(self.imu_msg)
-            self.get_logger().info("imu无信号")
-
-            
-    def timer_callback2(self):
-        """读取解析数据"""
-
-        line = self.ser.readline()
-        line = str(line)
-
-        """gps数据"""
-        if str(list[0]) == "$GPGGA":
-            if list[1] != "":
-                self.gps_msg.latitude = float(list[2])/100
-                self.gps_msg.longitude = float(list[4])/100
-                self.gps_msg.altitude = float(list[9])
-
-                self.gps_flag = 1
 
+        elif message["type"] == "INSATT":
+            """imu欧拉角(度)转四元数"""
+            x, y, z, w = self.Eular2Quat([math.radians(angle) for angle in message["euler"]])
+            self.imu_msg.orientation.x = x
+            self.imu_msg.orientation.y = y
+            self.imu_msg.orientation.z = z
+            self.imu_msg.orientation.w = w
+
+        elif message["type"] == "GPGGA":
+            """gps数据"""
+            if message["fix"]:
+                self.gps_msg.latitude = message["latitude"]
+                self.gps_msg.longitude = message["longitude"]
+                self.gps_msg.altitude = message["altitude"]
             else:
-                self.gps_flag = 0
-                self.gps_pub.publish(self.gps_msg)
                 self.get_logger().info("gps无信号")
-
-        
-        elif str(list[0]) == "#CORRIMUDATAA":
-            """imu校正数据"""
-            header, list = line.split(';')
-            list = list.split(',')
-
-            if list[1] != "":
-                PitchRate = float(list[2])
-                RollRate = float(list[3])
-                YawRate = float(list[4])
-                LateralAcc = float(list[5])
-                LongitudinalAcc = float(list[6])
-                VerticalAcc = float(list[7])
-
-                self.imu_msg.angular_velocity.x = PitchRate
-                self.imu_msg.angular_velocity.y = RollRate
-                self.imu_msg.angular_velocity.z = YawRate
-
-                self.imu_msg.linear_acceleration.x = LateralAcc
-                self.imu_msg.linear_acceleration.y = LongitudinalAcc
-                self.imu_msg.linear_acceleration.z = VerticalAcc
-
-                if(self.imu_flag == -1): self.imu_flag = 1
-                else: self.imu_flag = -1
-
-            else:
-                self.imu_flag = 0
-
-        elif str(list[0]) == "#INSATTA":
-            """imu欧拉角"""
-            header, list = line.split(';')
-            list = list.split(',')
-
-            if list[1] != "":
-                """欧拉角转四元数"""
-                Roll = float(list[2])
-                Pitch = float(list[3])
-                Azimuth = float(list[4])
-
-                x, y, z, w = self.Eular2Quat([Roll, Pitch, Azimuth])
-
-                self.imu_msg.orientation.x = x
-                self.imu_msg.orientation.y = y
-                self.imu_msg.orientation.z = z
-                self.imu_msg.orientation.w = w
-
-                if(self.imu_flag == -1): self.imu_flag = 1
-                else: self.imu_flag = -1
-
-            else:
-                self.imu_flag = 0
-
-
-        """发布数据"""
-        if(self.gps_flag == 1):
+            self.gps_msg.header.stamp = message["stamp"]
             self.gps_pub.publish(self.gps_msg)
-            self.get_logger().info("发布gps消息")
-        elif(self.gps_flag == 0):
-            self.gps_pub.publish(self.gps_msg)
-            self.get_logger().info("gps无信号")
-
-        if(self.imu_flag == 1):
-            self.imu_pub.publish(self.imu_msg)
-            self.get_logger().info("发布imu消息")
-        elif(self.imu_flag == 0):
-            self.imu_pub.publish(self.imu_msg)
-            self.get_logger().info("imu无信号")
 
 
 def main(args = None):
@@ -218,4 +125,6 @@ def main(args = None):
 
     """保持节点"""
     rclpy.spin(node)
+    node.running = False
+    node.reader.join()
     rclpy.shutdown()
@@ -0,0 +1,220 @@
+import re
+import struct
+import zlib
+
+
+"""原始IMU数据的比例因子(角速度, 加速度)"""
+GYRO_SCALE = 3.0517578125e-05
+ACCEL_SCALE = 3.74094e-06
+
+"""二进制日志: 同步字, 消息ID"""
+BINARY_SYNC = b'\xaa\x44\x12'
+RAWIMUB_ID = 268
+INSATTB_ID = 263
+
+_START = re.compile(rb'[#$]|\xaa\x44\x12')
+_BINARY_HEADER = struct.Struct('<3sBHBBHHBBHlLHH')
+_RAWIMUB = struct.Struct('<Idl6l')
+_INSATTB = struct.Struct('<Id3dI')
+_CRC = struct.Struct('<L')
+
+SECONDS_PER_WEEK = 604800
+
+
+def crc32(data):
+    """NovAtel的32位CRC(初值0, 不取反), 由zlib.crc32按线性关系换算"""
+    return zlib.crc32(data) ^ zlib.crc32(bytes(len(data)))
+
+
+class NovatelParser():
+    """
+    串口字节流的增量解析, 支持ASCII(#RAWIMUA, #INSATTA, $GPGGA)和二进制(RAWIMUB, INSATTB)日志
+
+    feed每次输入任意长度的字节块, 返回其中完整且校验通过的消息(dict), 不完整的部分留到下次.
+    每条消息的stamp由收到该字节块的时间按消息在块中的位置倒推: 块中最后一个字节在stamp时收到,
+    之前的字节每个早byte_time秒(串口波特率下一个字节的传输时间).
+    """
+    def __init__(self, max_line=1024, max_binary=4096):
+        self.buffer = bytearray()
+        self.max_line = max_line        #ASCII语句最大长度, 超过时视为乱码丢弃
+        self.max_binary = max_binary    #二进制日志最大长度, 超过时视为误同步
+        self.messages = 0               #解析成功的消息数
+        self.crc_errors = 0             #校验失败的消息数
+        self.discarded = 0              #丢弃的字节数
+        self.ascii_decoders = {
+            b'#RAWIMUA': self._decode_rawimua,
+            b'#INSATTA': self._decode_insatta,
+            b'$GPGGA': self._decode_gpgga,
+        }
+        self.binary_decoders = {
+            RAWIMUB_ID: self._decode_rawimub,
+            INSATTB_ID: self._decode_insattb,
+        }
+
+    def feed(self, data, stamp=None, byte_time=0.0):
+        """输入字节块, 返回完整的消息列表"""
+        self.buffer += data
+        buffer = self.buffer
+        messages = []
+        pos = 0
+
+        while True:
+            match = _START.search(buffer, pos)
+            if match is None:
+                """结尾可能是被分开的二进制同步字, 保留到下次"""
+                keep = 2 if buffer.endswith(BINARY_SYNC[:2]) else 1 if buffer.endswith(BINARY_SYNC[:1]) else 0
+                end = max(len(buffer) - keep, pos)
+                self.discarded += end - pos
+                pos = end
+                break
+            self.discarded += match.start() - pos
+            pos = match.start()
+
+            if buffer[pos] == 0xaa:
+                end, message = self._frame_binary(buffer, pos)
+            else:
+                end, message = self._frame_ascii(buffer, pos)
+
+            if end is None:
+                break
+            if message is not None:
+                message["stamp"] = stamp if stamp is None else stamp - (len(buffer) - end) * byte_time
+                messages.append(message)
+            pos = end
+
+        del buffer[:pos]
+        self.messages += len(messages)
+
+        return messages
+
+    def _frame_ascii(self, buffer, pos):
+        """截取一条ASCII语句, 返回(结束位置, 消息); 数据不完整时结束位置为None"""
+        end = buffer.find(b'\n', pos)
+        if end < 0:
+            if len(buffer) - pos > self.max_line:
+                self.discarded += 1
+                return pos + 1, None
+            return None, None
+
+        line = bytes(buffer[pos:end]).rstrip(b'\r')
+        star = line.rfind(b'*')
+        if star < 0:
+            self.discarded += end + 1 - pos
+            return end + 1, None
+
+        """#开头为32位CRC, $开头为NMEA异或校验"""
+        body, checksum = line[1:star], line[star + 1:]
+        try:
+            if line[:1] == b'#':
+                valid = crc32(body) == int(checksum, 16)
+            else:
+                xor = 0
+                for byte in body:
+                    xor ^= byte
+                valid = xor == int(checksum, 16)
+        except ValueError:
+            valid = False
+        if not valid:
+            self.crc_errors += 1
+            return end + 1, None
+
+        name = line[:line.find(b',')]
+        decoder = self.ascii_decoders.get(name)
+        if decoder is None:
+            return end + 1, None
+        try:
+            return end + 1, decoder(line[:star])
+        except (ValueError, IndexError):
+            return end + 1, None
+
+    def _frame_binary(self, buffer, pos):
+        """截取一条二进制日志, 返回(结束位置, 消息); 数据不完整时结束位置为None"""
+        if len(buffer) - pos < _BINARY_HEADER.size:
+            return None, None
+
+        header = _BINARY_HEADER.unpack_from(buffer, pos)
+        header_length, message_id, message_length = header[1], header[2], header[5]
+        end = pos + header_length + message_length + _CRC.size
+        if header_length < _BINARY_HEADER.size or end - pos > self.max_binary:
+            self.discarded += 1
+            return pos + 1, None
+        if len(buffer) < end:
+            return None, None
+
+        if crc32(bytes(buffer[pos:end - _CRC.size])) != _CRC.unpack_from(buffer, end - _CRC.size)[0]:
+            self.crc_errors += 1
+            self.discarded += 1
+            return pos + 1, None
+
+        decoder = self.binary_decoders.get(message_id)
+        if decoder is None:
+            return end, None
+        return end, decoder(buffer, pos + header_length)
+
+    def _get_imu(self, week, seconds, raw):
+        """原始计数(z加速度, -y加速度, x加速度, z角速度, -y角速度, x角速度)转为IMU消息"""
+        z_acc, y_acc, x_acc, z_gyro, y_gyro, x_gyro = raw
+        return {
+            "type": "RAWIMU",
+            "week": week,
+            "seconds": seconds,
+            "rate": (x_gyro * GYRO_SCALE, -y_gyro * GYRO_SCALE, z_gyro * GYRO_SCALE),
+            "acc": (x_acc * ACCEL_SCALE, -y_acc * ACCEL_SCALE, z_acc * ACCEL_SCALE),
+        }
+
+    def _decode_rawimua(self, line):
+        fields = line.split(b';')[1].split(b',')
+        return self._get_imu(int(fields[0]), float(fields[1]), [int(field) for field in fields[3:9]])
+
+    def _decode_rawimub(self, buffer, offset):
+        week, seconds, _, *raw = _RAWIMUB.unpack_from(buffer, offset)
+        return self._get_imu(week, seconds, raw)
+
+    def _decode_insatta(self, line):
+        fields = line.split(b';')[1].split(b',')
+        return {
+            "type": "INSATT",
+            "week": int(fields[0]),
+            "seconds": float(fields[1]),
+            "euler": (float(fields[2]), float(fields[3]), float(fields[4])),
+        }
+
+    def _decode_insattb(self, buffer, offset):
+        week, seconds, roll, pitch, azimuth, _ = _INSATTB.unpack_from(buffer, offset)
+        return {"type": "INSATT", "week": week, "seconds": seconds, "euler": (roll, pitch, azimuth)}
+
+    def _decode_gpgga(self, line):
+        fields = line.split(b',')
+        if fields[1] == b'':
+            return {"type": "GPGGA", "fix": False}
+        return {
+            "type": "GPGGA",
+            "fix": True,
+            "latitude": float(fields[2]) / 100,
+            "longitude": float(fields[4]) / 100,
+            "altitude": float(fields[9]),
+        }
+
+
+class GpsClock():
+    """
+    带GPS时间(周, 秒)的消息换算到本机时间: 本机时间 = GPS时间 + 偏差
+
+    偏差取收到时间与GPS时间之差的最小值(传输延迟最小的那条), 同一块中的多条消息按各自的GPS时间
+    得到不同且递增的时间戳. 偏差变化超过max_jump秒(接收机或本机时间跳变)时重新估计.
+    """
+    def __init__(self, max_jump=1.0):
+        self.offset = None
+        self.max_jump = max_jump
+
+    def stamp(self, message):
+        """返回消息的本机时间, 没有GPS时间的消息保持其收到时间"""
+        if "week" not in message or message["stamp"] is None:
+            return message["stamp"]
+
+        gps = message["week"] * SECONDS_PER_WEEK + message["seconds"]
+        offset = message["stamp"] - gps
+        if self.offset is None or offset < self.offset or offset - self.offset > self.max_jump:
+            self.offset = offset
+
+        return gps + self.offset
@@ -0,0 +1,173 @@
+import argparse
+import glob
+import sqlite3
+import struct
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.spatial.transform import Rotation
+import yaml
+
+
+import sys,os
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+
+from LOAM import LOAM, FeatureExtraction
+from decoder import PointCloudDecoder, Rs16MsopDecoder
+
+
+def read_bag(path, topic="/rslidar_points", lidar_type="RS16"):
+    """按时间顺序读取rosbag2(.db3文件或所在目录)中的点云, 返回(时间, (坐标, 线号, 列号, 相对时间))
+
+    只有读rosbag2时才需要ROS2环境, 读pcap不依赖rclpy.
+    """
+    from rclpy.serialization import deserialize_message
+    from sensor_msgs.msg import PointCloud2
+
+    files = sorted(glob.glob(os.path.join(path, "*.db3"))) if os.path.isdir(path) else [path]
+    decoder = PointCloudDecoder(lidar_type)
+    for file in files:
+        connection = sqlite3.connect(file)
+        rows = connection.execute(
+            "SELECT messages.timestamp, messages.data FROM messages JOIN topics ON messages.topic_id = topics.id "
+            "WHERE topics.name = ? ORDER BY messages.timestamp", (topic,))
+        for timestamp, data in rows:
+            msg = deserialize_message(data, PointCloud2)
+            stamp = msg.header.stamp.sec + msg.header.stamp.nanosec * 1e-9 or timestamp * 1e-9
+            yield stamp, decoder.decode(msg)
+        connection.close()
+
+
+def read_pcap(path, port=2244, lidar_type="RS16"):
+    """读取pcap中RS16的MSOP数据包并拼帧, 返回(时间, (坐标, 线号, 列号, None))"""
+    decoder = PointCloudDecoder(lidar_type)
+    msop = Rs16MsopDecoder()
+    with open(path, "rb") as f:
+        magic = f.read(24)[:4]
+        endian = "<" if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1") else ">"
+        scale = 1e-9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e-6
+        record = struct.Struct(endian + "IIII")
+
+        while True:
+            header = f.read(record.size)
+            if len(header) < record.size:
+                break
+            sec, frac, length, _ = record.unpack(header)
+            data = f.read(length)
+
+            """以太网 + IPv4 + UDP"""
+            if len(data) < 42 or data[12:14] != b"\x08\x00" or data[23] != 17:
+                continue
+            ip_length = (data[14] & 0x0f) * 4
+            udp = 14 + ip_length
+            if struct.unpack_from(">H", data, udp + 2)[0] != port:
+                continue
+            payload = data[udp + 8:]
+            if len(payload) != 1248:
+                continue
+
+            xyz = msop.feed(payload)
+            if xyz is not None:
+                yield sec + frac * scale, (xyz,) + decoder.label(xyz) + (None,)
+
+    xyz = msop.flush()
+    if xyz is not None:
+        yield sec + frac * scale, (xyz,) + decoder.label(xyz) + (None,)
+
+
+_feature_extraction = None
+
+
+def extract(frame, lidar_type="RS16"):
+    """进程池中提取特征, 每个进程复用一个FeatureExtraction"""
+    global _feature_extraction
+    if _feature_extraction is None:
+        _feature_extraction = FeatureExtraction(lidar_type=lidar_type)
+    _feature_extraction.process(_feature_extraction.scan.load(*frame))
+
+    return _feature_extraction.features
+
+
+def run(frames, workers=0, lookahead=None, lidar_type="RS16", deskew=True):
+    """按顺序运行LOAM, 返回(时间, 全局位姿4*4)
+
+    workers为0时在本进程中逐帧处理, deskew为True时做运动畸变校正(与在线节点相同);
+    否则特征提取在进程池中提前进行(最多lookahead帧), 里程计和建图按帧顺序在本进程中进行.
+    进程池中没有上一帧的运动, 不论deskew如何都不做运动畸变校正, 结果与在线节点不同.
+    """
+    loam = LOAM(lidar_type, deskew)
+    if workers == 0:
+        for stamp, frame in frames:
+            odom_pose = loam.input(loam.feature_extraction.scan.load(*frame), stamp=stamp)
+            yield stamp, loam.lidar_mapping.pose(odom_pose)
+        return
+
+    lookahead = lookahead or 2 * workers
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for stamp, frame in frames:
+            pending.append((stamp, pool.submit(extract, frame, lidar_type)))
+            if len(pending) >= lookahead:
+                stamp, future = pending.popleft()
+                yield stamp, odometry(loam, future.result(), stamp)
+        while pending:
+            stamp, future = pending.popleft()
+            yield stamp, odometry(loam, future.result(), stamp)
+
+
+def odometry(loam, features, stamp=None):
+    """一帧特征的里程计和建图, 返回全局位姿"""
+    loam.lidar_odometry.process(features)
+    odom_pose, _ = loam.odometry_to_mapping(features, stamp=stamp)
+
+    return loam.lidar_mapping.pose(odom_pose)
+
+
+def write_pose(f, stamp, pose, format="tum"):
+    """TUM: 时间 x y z qx qy qz qw; KITTI: 3*4位姿矩阵按行展开"""
+    if format == "tum":
+        q = Rotation.from_matrix(pose[:3, :3]).as_quat()
+        f.write("%.9f %.9f %.9f %.9f %.9f %.9f %.9f %.9f\n" % (stamp, *pose[:3, 3], *q))
+    else:
+        f.write(" ".join("%.9e" % value for value in pose[:3].reshape(-1)) + "\n")
+
+
+def main(args = None):
+    """
+    离线运行LOAM, 输入rosbag2或pcap, 输出位姿文件
+    """
+    parser = argparse.ArgumentParser(description="离线运行LOAM")
+    parser.add_argument("input", help="rosbag2的.db3文件或目录, 或.pcap文件")
+    parser.add_argument("-o", "--output", default="poses.txt")
+    parser.add_argument("-f", "--format", choices=("tum", "kitti"), default="tum")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() - 1,
+                        help="特征提取进程数; 大于0时不做运动畸变校正, 与在线节点结果不同, 需要校正时用-j 0")
+    parser.add_argument("--topic", default="/rslidar_points")
+    parser.add_argument("--lidar-type", default="RS16")
+    parser.add_argument("--msop-port", type=int, default=2244)
+    parser.add_argument("--lidar-config", help="rslidar_sdk的config.yaml, 给定时从中读取激光雷达型号和MSOP端口")
+    parser.add_argument("--deskew", action=argparse.BooleanOptionalAction, default=True,
+                        help="按上一帧运动做运动畸变校正(仅-j 0时有效)")
+    args = parser.parse_args(args)
+    if args.lidar_config:
+        with open(args.lidar_config) as f:
+            driver = yaml.safe_load(f)["lidar"][0]["driver"]
+        args.lidar_type, args.msop_port = driver["lidar_type"], driver["msop_port"]
+    if args.deskew and args.workers > 0:
+        print("-j %d: 进程池中不做运动畸变校正, 结果与在线节点不同; 用-j 0校正或--no-deskew关闭此提示" % args.workers)
+
+    if args.input.endswith(".pcap"):
+        frames = read_pcap(args.input, args.msop_port, args.lidar_type)
+    else:
+        frames = read_bag(args.input, args.topic, args.lidar_type)
+
+    t0 = time.time()
+    count = 0
+    with open(args.output, "w") as f:
+        for stamp, pose in run(frames, args.workers, lidar_type=args.lidar_type, deskew=args.deskew):
+            write_pose(f, stamp, pose, args.format)
+            count += 1
+    elapsed = time.time() - t0
+    print("%d帧, %.1fs, %.1f帧/s" % (count, elapsed, count / elapsed if elapsed > 0 else 0))
@@ -0,0 +1,154 @@
+import logging
+import time
+import threading
+from collections import deque
+
+
+class BufferPool():
+    """
+    预分配缓冲区的空闲链表, 线程安全
+
+    acquire取出一个空闲缓冲区, 没有空闲时返回None; 缓冲区由最后使用它的一方release归还,
+    归还之前不会再分配给其他帧.
+    """
+    def __init__(self, factory, size):
+        self.free = deque(factory() for _ in range(size))
+        self.size = size
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            return self.free.popleft() if self.free else None
+
+    def release(self, buffer):
+        with self.lock:
+            self.free.append(buffer)
+
+    def __len__(self):
+        """空闲缓冲区数"""
+        return len(self.free)
+
+
+class DropQueue():
+    """
+    有界队列, 满时按策略丢弃最旧("oldest")或最新("newest")的帧
+
+    on_drop(item)在丢弃帧时调用(锁外), 用于归还帧占用的缓冲区.
+    """
+    def __init__(self, maxsize=1, drop="oldest", on_drop=None):
+        self.queue = deque()
+        self.maxsize = maxsize
+        self.drop = drop
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        """放入一帧, 返回是否入队"""
+        dropped = None
+        with self.cond:
+            if len(self.queue) >= self.maxsize:
+                self.dropped += 1
+                if self.drop == "oldest":
+                    dropped = self.queue.popleft()
+                else:
+                    dropped = item
+            if dropped is not item:
+                self.queue.append(item)
+                self.cond.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+        return dropped is not item
+
+    def get(self, timeout=None):
+        """取出一帧, 超时返回None"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.queue) > 0, timeout):
+                return None
+            return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class Stage(threading.Thread):
+    """
+    流水线的一级: 在独立线程中从输入队列取帧, 处理后放入下一级
+
+    func接收并返回帧(dict), 返回None表示丢弃该帧. 每级耗时记录在frame["latency"][name].
+    func抛出异常时记录日志, 该帧计为丢弃, 线程继续处理后面的帧. 队列满丢弃的帧和出错的帧都交给on_drop.
+    """
+    def __init__(self, name, func, maxsize=1, drop="oldest", next_stage=None, logger=None, on_drop=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.on_drop = on_drop
+        self.input = DropQueue(maxsize, drop, on_drop)
+        self.next_stage = next_stage
+        self.logger = logging.getLogger(__name__) if logger is None else logger    #需要error方法, 如rclpy节点的logger
+        self.errors = 0
+        self.running = True
+
+    def put(self, frame):
+        return self.input.put(frame)
+
+    def run(self):
+        while self.running:
+            frame = self.input.get(timeout=0.1)
+            if frame is None:
+                continue
+
+            t0 = time.time()
+            try:
+                out = self.func(frame)
+            except Exception as e:
+                self.errors += 1
+                with self.input.cond:
+                    self.input.dropped += 1
+                self.logger.error("%s: %s: %s" % (self.name, type(e).__name__, e))
+                out = None
+            if out is None:
+                if self.on_drop is not None:
+                    self.on_drop(frame)
+                continue
+            out.setdefault("latency", {})[self.name] = time.time() - t0
+
+            if self.next_stage is not None:
+                self.next_stage.put(out)
+
+    def stop(self):
+        self.running = False
+
+
+class Pipeline():
+    """
+    多级流水线, 各级之间为有界队列
+    """
+    def __init__(self, stages, maxsize=1, drop="oldest", logger=None, on_drop=None):
+        """stages为[(name, func), ...], 按顺序串联; on_drop为任一级丢弃帧时的回调"""
+        self.stages = []
+        next_stage = None
+        for name, func in reversed(stages):
+            next_stage = Stage(name, func, maxsize, drop, next_stage, logger, on_drop)
+            self.stages.insert(0, next_stage)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join()
+
+    def put(self, frame):
+        """输入一帧, 记录进入流水线的时间"""
+        frame.setdefault("t_in", time.time())
+        frame.setdefault("latency", {})
+
+        return self.stages[0].put(frame)
+
+    def dropped(self):
+        """各级丢弃的帧数"""
+        return {stage.name: stage.input.dropped for stage in self.stages}
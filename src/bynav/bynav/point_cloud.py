@@ -1,11 +1,12 @@
+import threading
 import time
-import math
-import struct
 import rclpy
 import numpy as np
 from rclpy.node import Node
-from sensor_msgs.msg import PointCloud2
+from sensor_msgs.msg import Imu, PointCloud2
+from std_msgs.msg import Float64MultiArray
 import open3d as o3d
+import yaml
 
 
 import sys,os
@@ -13,7 +14,12 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
 
 from Cul_Curvature import Cul_Curvature
-from LOAM import LOAM
+from LOAM import LOAM, ScanFrame
+from filters import voxel_downsample
+from pipeline import BufferPool, Pipeline, Stage
+from imu import ImuPreintegration
+from sensor_buffer import SensorBuffer
+from decoder import PointCloudDecoder
 
 
 class Node_PC(Node):
@@ -24,93 +30,211 @@ class Node_PC(Node):
         super().__init__(name)
         self.get_logger().info("point_cloud节点已创建")
 
+        """流水线参数"""
+        self.declare_parameter("queue_size", 1)
+        self.declare_parameter("drop_policy", "oldest")
+        queue_size = self.get_parameter("queue_size").value
+        drop_policy = self.get_parameter("drop_policy").value
+
+        """激光雷达型号, 给定rslidar_sdk的config.yaml时从中读取"""
+        self.declare_parameter("lidar_type", "RS16")
+        self.declare_parameter("lidar_config", "")
+        self.lidar_type = self.get_parameter("lidar_type").value
+        lidar_config = self.get_parameter("lidar_config").value
+        if lidar_config:
+            with open(lidar_config) as f:
+                self.lidar_type = yaml.safe_load(f)["lidar"][0]["driver"]["lidar_type"]
+        self.decoder = PointCloudDecoder(self.lidar_type)
+
+        """运动畸变校正: "odometry"按上一帧里程计, "imu"按/imu角速度, "none"不校正"""
+        self.declare_parameter("deskew", "odometry")
+        self.deskew = self.get_parameter("deskew").value
+
+        """IMU数据按时间戳缓存, 由畸变校正(deskew为"imu"时)和里程计初值按扫描时刻查询, 定时记录各数据流的统计"""
+        self.sensors = SensorBuffer()
+        self.sensors.add_stream("imu", 6, 2000)    #角速度, 加速度
+        self.declare_parameter("sensor_stats_period", 10.0)
+
+        """IMU预积分, 为里程计提供初值"""
+        self.declare_parameter("imu_prior", True)
+        self.imu_prior = self.get_parameter("imu_prior").value
+        self.imu = ImuPreintegration(self.sensors.streams["imu"])
+        self.last_stamp = None
+
+        """预分配的帧缓冲, 解析时取出, 帧被丢弃或显示完后归还; 数量不少于流水线中同时存在的帧数(各级队列, 处理中和显示中)"""
+        self.scan_frames = BufferPool(ScanFrame, 5 * (queue_size + 1) + 2)
+        self.vis_lock = threading.Lock()
+
         """创建并初始化接收"""
         self.sub_point_cloud = self.create_subscription(PointCloud2, "/rslidar_points", self.callback, 10)
-
-        """配置可视化"""
-        self.vis = o3d.visualization.Visualizer()
-        self.vis.create_window()
-        self.o3d_pcd = o3d.geometry.PointCloud()
-        self.o3d_pcd_curv = o3d.geometry.PointCloud()
-        self.ctr = self.vis.get_view_control()
+        self.latency_pub = self.create_publisher(Float64MultiArray, "point_cloud/latency", 10)
+        if self.deskew == "imu" or self.imu_prior:
+            self.sub_imu = self.create_subscription(Imu, "/imu", self.imu_callback, 100)
+        self.stats_timer = self.create_timer(self.get_parameter("sensor_stats_period").value, self.stats_callback)
+
+        """配置可视化: headless时不创建窗口; 否则按vis_rate(Hz)显示最新一帧, 来不及显示的帧丢弃"""
+        self.declare_parameter("headless", False)
+        self.declare_parameter("vis_rate", 10.0)
+        self.declare_parameter("vis_leaf_size", 0.1)
+        self.headless = self.get_parameter("headless").value
+        self.vis_leaf_size = self.get_parameter("vis_leaf_size").value    #显示前体素降采样(m), 0为不降采样
+        self.vis_frame = None
+        self.vis_dropped = 0
+        if not self.headless:
+            self.vis = o3d.visualization.Visualizer()
+            self.vis.create_window()
+            self.o3d_pcd = o3d.geometry.PointCloud()
+            self.o3d_pcd_curv = o3d.geometry.PointCloud()
+            self.ctr = self.vis.get_view_control()
+            self.vis_added = False
+            self.vis_timer = self.create_timer(1.0 / self.get_parameter("vis_rate").value, self.vis_callback)
 
         """LOAM算法"""
         self.Cul_Curv = Cul_Curvature()
-        self.loam = LOAM()
+        self.loam = LOAM(self.lidar_type)
+
+        """解析 -> 畸变校正 -> 特征提取 -> 里程计 -> 建图, 各级独立线程"""
+        self.pipeline = Pipeline([
+            ("decode", self.decode_stage),
+            ("deskew", self.deskew_stage),
+            ("feature", self.feature_stage),
+            ("odometry", self.odometry_stage),
+            ("map", self.map_stage),
+        ], queue_size, drop_policy, self.get_logger(), self.release_frame)
+        self.mapping_stage = Stage("mapping", self.mapping, logger=self.get_logger())
+        self.pipeline.start()
+        self.mapping_stage.start()
 
     def callback(self, data):
-        """读取解析数据"""
+        """接收数据, 放入流水线后立即返回"""
         assert isinstance(data, PointCloud2)
-        pcd_as_numpy_array = np.array(list(self.read_points(data)))
-        self.pcn = self.label(pcd_as_numpy_array)
-        
+        self.pipeline.put({"msg": data})
+
+    def imu_callback(self, data):
+        """按时间戳存入IMU缓冲区"""
+        stamp = data.header.stamp.sec + data.header.stamp.nanosec * 1e-9
+        w, a = data.angular_velocity, data.linear_acceleration
+        self.sensors.put("imu", stamp, (w.x, w.y, w.z, a.x, a.y, a.z))
+
+    def stats_callback(self):
+        """记录各数据流的频率, 迟到和被覆盖的个数"""
+        for name, stats in self.sensors.statistics().items():
+            self.get_logger().info("%s: %d个, %.1fHz, 迟到%d, 覆盖%d, 重读%d" % (
+                name, stats["count"], stats["rate"], stats["late"], stats["overwritten"], stats["retries"]))
+
+    def decode_stage(self, frame):
+        """读取解析数据"""
+        msg = frame.pop("msg")
+        frame["stamp"] = msg.header.stamp.sec + msg.header.stamp.nanosec * 1e-9
+
+        scan = self.scan_frames.acquire()
+        if scan is None:
+            self.get_logger().warn("没有空闲的帧缓冲, 丢弃该帧")
+            return None
+        frame["scan"] = scan
+        scan.load(*self.decoder.decode(msg))
+
+        return frame
+
+    def release_frame(self, frame):
+        """帧不再使用, 归还其帧缓冲"""
+        scan = frame.pop("scan", None)
+        if scan is not None:
+            self.scan_frames.release(scan)
+
+    def deskew_stage(self, frame):
+        """运动畸变校正, 匀速假设下用上一帧的运动"""
+        if self.deskew == "none":
+            return frame
+
+        T = self.loam.lidar_odometry.T_last
+        period = self.loam.deskew.period
+        rate = self.imu.mean_rate(frame["stamp"] - period, frame["stamp"]) if self.deskew == "imu" else None
+        self.loam.deskew.process(frame["scan"], T, rate)
+
+        return frame
+
+    def feature_stage(self, frame):
+        """提取特征"""
+        feature_extraction = self.loam.feature_extraction
+        feature_extraction.process(frame["scan"])
+        frame["features"] = feature_extraction.features
+
+        return frame
+
+    def odometry_stage(self, frame):
+        """激光里程计, 按到达顺序处理, 有IMU数据时用两帧之间的旋转作初值"""
+        lidar_odometry = self.loam.lidar_odometry
+        T0 = None
+        if self.imu_prior and self.last_stamp is not None:
+            T0 = self.imu.get_T(self.last_stamp, frame["stamp"], lidar_odometry.T_last)
+        self.last_stamp = frame["stamp"]
+        lidar_odometry.process(frame["features"], T0)
+        frame["T"] = np.array(lidar_odometry.T)
+
+        """低频建图在独立线程中进行, 这里只取当前的全局位姿"""
+        frame["odom_pose"], due = self.loam.odometry_to_mapping(frame["features"], sync=False, stamp=frame["stamp"])
+        if due:
+            self.mapping_stage.put(frame)
+        frame["pose"] = self.loam.lidar_mapping.pose(frame["odom_pose"])
+
+        return frame
+
+    def mapping(self, frame):
+        """scan-to-map修正全局位姿"""
+        self.loam.lidar_mapping.process(frame["features"], frame["odom_pose"])
+
+        return frame
+
+    def map_stage(self, frame):
+        """建图并发布各级耗时"""
         t0 = time.time()
-        self.loam.input(self.pcn)
-        print("T:", time.time()-t0)
-        
-        #self.curv_pcn = self.Cul_Curv.process(self.pcn)
-        self.curv_pcn = self.loam.output(self.pcn)
-
-        """可视化点云"""
-        self.vis.remove_geometry(self.o3d_pcd_curv)
-        self.vis.remove_geometry(self.o3d_pcd)
-        self.o3d_pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.pcn[:,:3]))
-        self.o3d_pcd_curv = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(self.curv_pcn[:,:3]))
+        #frame["curv_pcn"] = self.Cul_Curv.process(frame["pcn"])
+        frame["curv_pcn"] = self.loam.output(frame["scan"])
+        if self.headless:
+            self.release_frame(frame)
+        else:
+            with self.vis_lock:
+                replaced, self.vis_frame = self.vis_frame, frame
+            if replaced is not None:    #上一帧还没显示
+                self.vis_dropped += 1
+                self.release_frame(replaced)
+
+        latency = frame["latency"]
+        latency["map"] = time.time() - t0
+        latency["total"] = time.time() - frame["t_in"]
+        msg = Float64MultiArray()
+        msg.data = [latency[name] * 1000 for name in ("decode", "deskew", "feature", "odometry", "map", "total")]
+        self.latency_pub.publish(msg)
+
+        return frame
+
+    def vis_callback(self):
+        """可视化点云, 只显示最新一帧, 原地更新已有的几何体"""
+        with self.vis_lock:
+            frame, self.vis_frame = self.vis_frame, None
+        if frame is None:
+            self.vis.poll_events()
+            return
+
+        leaf_size = self.vis_leaf_size or None
+        points = voxel_downsample(frame["scan"].points, leaf_size)
+        curv_points = voxel_downsample(frame["curv_pcn"][:, :3], leaf_size)
+        self.o3d_pcd.points = o3d.utility.Vector3dVector(np.asarray(points, dtype=np.float64))
+        self.o3d_pcd_curv.points = o3d.utility.Vector3dVector(np.asarray(curv_points, dtype=np.float64))
+        self.release_frame(frame)   #不降采样时points是帧缓冲的视图, 复制进Open3D之后才能归还
         self.o3d_pcd.paint_uniform_color([60/255, 80/255, 120/255])
         self.o3d_pcd_curv.paint_uniform_color([255/255, 0/255, 0/255])
-        self.vis.add_geometry(self.o3d_pcd)
-        self.vis.add_geometry(self.o3d_pcd_curv)
+        if not self.vis_added:
+            self.vis.add_geometry(self.o3d_pcd)
+            self.vis.add_geometry(self.o3d_pcd_curv)
+            self.vis_added = True
+        else:
+            self.vis.update_geometry(self.o3d_pcd)
+            self.vis.update_geometry(self.o3d_pcd_curv)
         #self.vis.run()
         self.vis.update_renderer()
         self.vis.poll_events()
-    
-    def label(self, pcn):
-        """给点云标注角度和线"""
-        scan_mat = np.zeros(pcn.shape[0])
-        degree_mat = np.zeros(pcn.shape[0])
-        
-        if pcn.shape[0] == 28800:
-            for i in range(pcn.shape[0]):
-                scan_mat[i] = (i % 16) if (i % 16) < 9 else 24 - (i % 16)
-                degree_mat[i] = i % 1800
-        else:
-            pass # 可改为计算
-            
-        scan_mat = np.resize(scan_mat, (pcn.shape[0], 1))
-        degree_mat = np.resize(degree_mat, (pcn.shape[0], 1))
-        pcn = np.concatenate((pcn, scan_mat, degree_mat), axis = 1)
-        
-        return pcn
-
-    def read_points(self, cloud):
-        """读取点云数据"""
-        assert isinstance(cloud, PointCloud2)
-        fmt = self._get_struct_fmt(cloud.is_bigendian, cloud.fields)
-        width, height, point_step, row_step, data, isnan = cloud.width, cloud.height, cloud.point_step, cloud.row_step, cloud.data, math.isnan
-        unpack_from = struct.Struct(fmt).unpack_from
-
-        for v in range(height):
-            offset = row_step * v
-            for u in range(width):
-                yield unpack_from(data, offset)
-                offset += point_step
-
-    def _get_struct_fmt(self, is_bigendian, fields, field_names=None):
-        """获取数据格式"""
-        fmt = '>' if is_bigendian else '<'
-
-        offset = 0
-        for field in (f for f in sorted(fields, key=lambda f: f.offset)):
-            if offset < field.offset:
-                fmt += 'x' * (field.offset - offset)
-                offset = field.offset
-            else:
-                datatype_fmt = 'f'
-                datatype_length = 4
-                fmt += field.count * datatype_fmt
-                offset += field.count * datatype_length
-
-        return fmt
 
 
 def main(args = None):
@@ -124,4 +248,8 @@ def main(args = None):
 
     """保持节点"""
     rclpy.spin(node)
+    node.pipeline.stop()
+    node.mapping_stage.stop()
+    if not node.headless:
+        node.vis.destroy_window()
     rclpy.shutdown()
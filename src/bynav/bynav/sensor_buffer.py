@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class StreamBuffer():
+    """
+    单个传感器数据流的环形缓冲区, 按时间递增存放(时间, 数值向量), 容量固定
+
+    只有一个线程写入, 写完数据后才增加count, 因此不加锁. 读取时先取count, 按count读完后再检查:
+    若读取期间写入了新数据且缓冲区已满, 最旧的数据可能在读取中途被覆盖, 丢弃结果重读(_read).
+    环形缓冲区最多分为两段有序数据, 按时间查找为两段上的二分查找, O(log n).
+    """
+    def __init__(self, dim, capacity=2000):
+        self.stamp = np.zeros(capacity)
+        self.value = np.zeros((capacity, dim))
+        self.capacity = capacity
+        self.count = 0          #累计写入的数据个数
+        self.late = 0           #时间不晚于最新数据而丢弃的个数
+        self.retries = 0        #读取期间数据被覆盖而重读的次数
+
+    def put(self, stamp, value):
+        """写入一个数据, 迟到(时间不晚于最新数据)时丢弃, 返回是否写入"""
+        count = self.count
+        if count > 0 and stamp <= self.stamp[(count - 1) % self.capacity]:
+            self.late += 1
+            return False
+
+        index = count % self.capacity
+        self.stamp[index] = stamp
+        self.value[index] = value
+        self.count = count + 1
+
+        return True
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _read(self, read):
+        """返回read(count)的结果, 读取期间有数据被覆盖时重读; read只能读取count之前写入的数据"""
+        while True:
+            count = self.count
+            result = read(count)
+            latest = self.count
+            if latest == count or latest <= self.capacity:
+                return result
+            self.retries += 1
+
+    def _start(self, count):
+        """最旧数据的物理位置"""
+        return count % self.capacity if count > self.capacity else 0
+
+    def search(self, t, count=None):
+        """第一个时间不早于t的数据的逻辑位置(0为最旧), t可以是数组; count为读取时取得的数据个数"""
+        if count is None:
+            return self._read(lambda count: self.search(t, count))
+        if count <= self.capacity:
+            return np.searchsorted(self.stamp[:count], t)
+
+        start = count % self.capacity
+        older, newer = self.stamp[start:], self.stamp[:start]
+        return np.where(np.asarray(t) <= older[-1], np.searchsorted(older, t), older.shape[0] + np.searchsorted(newer, t))
+
+    def interpolate(self, t):
+        """t时刻的线性插值, t可以是数组; 超出缓冲区时间范围时为nan(标量t时返回None)"""
+        scalar = np.ndim(t) == 0
+        t = np.atleast_1d(np.asarray(t, dtype=float))
+
+        return self._read(lambda count: self._interpolate(t, count, scalar))
+
+    def _interpolate(self, t, count, scalar):
+        n = min(count, self.capacity)
+        if n == 0:
+            return None if scalar else np.full((t.shape[0], self.value.shape[1]), np.nan)
+
+        start = self._start(count)
+        oldest, newest = self.stamp[start], self.stamp[(count - 1) % self.capacity]
+        index = np.clip(self.search(t, count), 1, max(n - 1, 1))
+        i0 = (start + index - 1) % self.capacity
+        i1 = (start + np.minimum(index, n - 1)) % self.capacity
+        dt = self.stamp[i1] - self.stamp[i0]
+        w = np.where(dt > 0, (t - self.stamp[i0]) / np.where(dt > 0, dt, 1), 0)
+        value = self.value[i0] + w[:, np.newaxis] * (self.value[i1] - self.value[i0])
+        value[(t < oldest) | (t > newest)] = np.nan
+
+        if scalar:
+            return None if np.isnan(value[0]).any() else value[0]
+        return value
+
+    def window(self, t0, t1):
+        """从t0之前(含)最近的数据到t1之后(含)最近的数据, 按时间顺序返回(时间, 数值)的副本"""
+        return self._read(lambda count: self._window(t0, t1, count))
+
+    def _window(self, t0, t1, count):
+        n = min(count, self.capacity)
+        if n == 0:
+            return np.zeros(0), np.zeros((0, self.value.shape[1]))
+        first = int(self.search(t0, count))
+        if first >= n or self.stamp[(self._start(count) + first) % self.capacity] > t0:
+            first = max(first - 1, 0)
+        last = min(int(self.search(t1, count)), n - 1)
+        index = (self._start(count) + np.arange(first, last + 1)) % self.capacity
+
+        return self.stamp[index], self.value[index]
+
+    def statistics(self):
+        """数据个数, 迟到和被覆盖的个数, 缓冲区内的平均频率(Hz)"""
+        return self._read(self._statistics)
+
+    def _statistics(self, count):
+        n = min(count, self.capacity)
+        rate = 0.0
+        if n > 1:
+            start = self._start(count)
+            span = self.stamp[(count - 1) % self.capacity] - self.stamp[start]
+            rate = float((n - 1) / span) if span > 0 else 0.0
+
+        return {"count": count, "late": self.late, "overwritten": max(count - self.capacity, 0), "rate": rate, "retries": self.retries}
+
+
+class SensorBuffer():
+    """
+    各传感器数据流的时间同步缓冲区, 供各级按扫描或点的时刻查询传感器状态(目前为IMU)
+    """
+    def __init__(self):
+        self.streams = {}
+
+    def add_stream(self, name, dim, capacity=2000):
+        self.streams[name] = StreamBuffer(dim, capacity)
+        return self.streams[name]
+
+    def put(self, name, stamp, value):
+        return self.streams[name].put(stamp, value)
+
+    def interpolate(self, name, t):
+        return self.streams[name].interpolate(t)
+
+    def statistics(self):
+        return {name: stream.statistics() for name, stream in self.streams.items()}
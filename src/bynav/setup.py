@@ -21,7 +21,8 @@ setup(
     entry_points={
         'console_scripts': [
             "bynav_node = bynav.node:main",
-            "point_cloud_node = bynav.point_cloud:main"
+            "point_cloud_node = bynav.point_cloud:main",
+            "loam_offline = bynav.offline:main"
         ],
     },
 )
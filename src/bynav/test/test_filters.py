@@ -0,0 +1,60 @@
+import numpy as np
+
+from bynav.filters import crop_box, uniform_subsample, voxel_downsample
+
+
+def cloud(n=5000):
+    rng = np.random.default_rng(0)
+    return np.concatenate((rng.uniform(-30, 30, (n, 3)), rng.integers(0, 16, (n, 1)), rng.integers(0, 1800, (n, 1))), axis=1)
+
+
+def test_crop_box_applies_all_axes():
+    points = cloud()
+    out = crop_box(points, (-20, -20, -1), (20, 20, 1))
+
+    assert out.shape[1] == 5
+    assert np.all(np.abs(out[:, :2]) <= 20) and np.all(np.abs(out[:, 2]) <= 1)
+    inside = np.all(np.abs(points[:, :3]) <= (20, 20, 1), axis=1)
+    assert out.shape[0] == np.count_nonzero(inside)
+
+
+def test_voxel_downsample_centroid():
+    points = cloud()
+    out = voxel_downsample(points, 5.0)
+
+    voxel = np.floor(points[:, :3] / 5.0).astype(int)
+    keys, first, inverse = np.unique(voxel, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(first)
+    assert out.shape == (keys.shape[0], 5)
+
+    """坐标为体素内均值, 标签列取体素内最先出现的点"""
+    centroid = np.array([points[inverse == k, :3].mean(axis=0) for k in order])
+    np.testing.assert_allclose(out[:, :3], centroid, atol=1e-9)
+    np.testing.assert_array_equal(out[:, 3:], points[first[order], 3:])
+
+    first_points = voxel_downsample(points, 5.0, reduce="first")
+    np.testing.assert_array_equal(first_points, points[np.sort(first)])
+    assert uniform_subsample(points, 10).base is points
+
+
+def test_local_map_keeps_first_point_per_voxel_and_evicts():
+    from bynav.LOAM import LocalMap
+
+    points = cloud()
+    local_map = LocalMap(cube_size=10.0, radius=25.0, leaf_size={"edge": 1.0})
+    local_map.insert("edge", points[:2500])
+    local_map.insert("edge", points[2500:])
+    centers = points.copy()
+    centers[:, :3] = np.floor(points[:, :3]) + 0.5
+    local_map.insert("edge", centers)       #体素都已占用, 不插入
+
+    expected = voxel_downsample(points, 1.0, reduce="first")
+    out = local_map.get("edge")
+    assert sorted(map(tuple, out.tolist())) == sorted(map(tuple, expected.tolist()))
+
+    local_map.evict((0, 0, 0))
+    center = (np.array(list(local_map.cubes.keys())) + 0.5) * 10.0
+    assert np.all(np.linalg.norm(center, axis=1) <= 25.0)
+    near = local_map.get("edge", (0, 0, 0), 0)
+    assert np.all(np.floor(near[:, :3] / 10.0) == 0)
@@ -0,0 +1,59 @@
+import numpy as np
+
+from bynav.lie import (euler_to_matrix, interpolate, inverse, matrix_to_euler, rotate_points, se3_exp, se3_log,
+                       so3_exp, so3_log, transform_points)
+
+
+def test_exp_log_round_trip():
+    rng = np.random.default_rng(0)
+    rotvec = rng.uniform(-1.5, 1.5, (100, 3))
+    rotvec[0] = 0
+    rotvec[1] = 1e-9
+    rotvec[2] = np.array([1.0, 2.0, -2.0]) / 3 * (np.pi - 1e-6)
+
+    np.testing.assert_allclose(so3_log(so3_exp(rotvec)), rotvec, atol=1e-8)
+    np.testing.assert_allclose(np.einsum("nji,njk->nik", so3_exp(rotvec), so3_exp(rotvec)), np.broadcast_to(np.eye(3), (100, 3, 3)), atol=1e-12)
+
+    xi = np.concatenate((rotvec, rng.uniform(-5, 5, (100, 3))), axis=1)
+    np.testing.assert_allclose(se3_log(se3_exp(xi)), xi, atol=1e-8)
+    np.testing.assert_allclose(se3_exp(xi) @ inverse(se3_exp(xi)), np.broadcast_to(np.eye(4), (100, 4, 4)), atol=1e-12)
+
+
+def test_euler_matches_odometry_convention():
+    T = np.array([0.02, -0.01, 0.05, 0.3, -0.2, 0.1])
+    a, b, g = T[:3]
+    Rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    Ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    Rz = np.array([[np.cos(g), -np.sin(g), 0], [np.sin(g), np.cos(g), 0], [0, 0, 1]])
+    M = euler_to_matrix(T)
+
+    np.testing.assert_allclose(M[:3, :3], Rx @ Ry @ Rz, atol=1e-15)
+    np.testing.assert_allclose(M[:3, 3], T[3:])
+    np.testing.assert_allclose(matrix_to_euler(M), T[:3], atol=1e-15)
+
+
+def test_transform_points_does_not_copy_labels():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(-20, 20, (50, 5)).astype(np.float32)
+    points[:, 3:] = np.round(points[:, 3:])
+    labels = points[:, 3:].copy()
+    M = euler_to_matrix([0.1, 0.2, -0.3, 1.0, 2.0, 3.0])
+    s = rng.uniform(-1, 0, 50)
+    expected_xyz = points[:, :3] @ M[:3, :3].T + M[:3, 3]
+
+    """默认只返回坐标, 不复制也不修改标签列"""
+    xyz = transform_points(points, M)
+    assert xyz.shape == (50, 3) and xyz.dtype == np.float32
+    assert not np.shares_memory(xyz, points)
+    np.testing.assert_allclose(xyz, expected_xyz, rtol=1e-5, atol=1e-4)
+
+    """out=points原地变换, 标签列保持原样"""
+    out = transform_points(points, M, out=points)
+    assert out is points
+    np.testing.assert_array_equal(points[:, 3:], labels)
+    np.testing.assert_allclose(points[:, :3], expected_xyz, rtol=1e-5, atol=1e-4)
+
+    """逐点插值的位姿与按旋转向量逐点旋转一致"""
+    poses = interpolate(np.eye(4), M, s)
+    expected = rotate_points(s[:, np.newaxis] * so3_log(M[:3, :3]), points[:, :3].astype(float)) + s[:, np.newaxis] * M[:3, 3]
+    np.testing.assert_allclose(transform_points(points.astype(float), poses)[:, :3], expected, atol=1e-9)
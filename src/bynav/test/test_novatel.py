@@ -0,0 +1,87 @@
+import struct
+
+import numpy as np
+
+from bynav.novatel import BINARY_SYNC, INSATTB_ID, RAWIMUB_ID, GpsClock, NovatelParser, crc32
+
+
+def rawimua(seconds, raw):
+    body = ('RAWIMUA,ICOM4,0,0.0,FINESTEERING,2107,%.3f,00000000,0000,68;2107,%.9f,00000000,%s'
+            % (seconds, seconds, ','.join(str(value) for value in raw))).encode()
+    return b'#' + body + b'*%08x\r\n' % crc32(body)
+
+
+def binary(message_id, payload):
+    header = struct.pack('<3sBHBBHHBBHlLHH', BINARY_SYNC, 28, message_id, 0, 0, len(payload), 0, 0, 0, 2107, 0, 0, 0, 0)
+    return header + payload + struct.pack('<L', crc32(header + payload))
+
+
+def gpgga():
+    body = b'GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,'
+    xor = 0
+    for byte in body:
+        xor ^= byte
+    return b'$' + body + b'*%02X\r\n' % xor
+
+
+def recording(n):
+    """交替的ASCII/二进制IMU数据, 姿态, gps和乱码"""
+    rng = np.random.default_rng(0)
+    stream = []
+    for i in range(n):
+        raw = [int(value) for value in rng.integers(-30000, 30000, 6)]
+        stream.append(rawimua(i * 0.005, raw))
+        stream.append(binary(RAWIMUB_ID, struct.pack('<Idl6l', 2107, i * 0.005 + 0.0025, 0, *raw)))
+        if i % 10 == 0:
+            stream.append(binary(INSATTB_ID, struct.pack('<Id3dI', 2107, i * 0.005, 1.0, 2.0, 90.0, 3)))
+            stream.append(gpgga())
+            stream.append(b'\x00garbage\xaa\x44')
+
+    return b''.join(stream)
+
+
+def replay(parser, data, seed=1, byte_time=10 / 115200):
+    """按随机长度分块输入, 模拟串口读取, 每块的收到时间为其最后一个字节的传输完成时间"""
+    rng = np.random.default_rng(seed)
+    messages, pos = [], 0
+    while pos < len(data):
+        size = int(rng.integers(1, 512))
+        messages += parser.feed(data[pos:pos + size], (pos + size) * byte_time, byte_time)
+        pos += size
+
+    return messages
+
+
+def test_replay_no_drop():
+    n = 2000
+    parser = NovatelParser()
+    messages = replay(parser, recording(n))
+
+    imu = [message for message in messages if message["type"] == "RAWIMU"]
+    assert len(imu) == 2 * n
+    assert sum(message["type"] == "INSATT" for message in messages) == n // 10
+    assert sum(message["type"] == "GPGGA" for message in messages) == n // 10
+    assert parser.crc_errors == 0
+
+    """ASCII和二进制的同一组原始数据解析结果一致, 时间递增"""
+    assert imu[0]["rate"] == imu[1]["rate"] and imu[0]["acc"] == imu[1]["acc"]
+    assert np.all(np.diff([message["seconds"] for message in imu]) > 0)
+
+    """同一块中的消息时间戳各不相同: 按字节位置倒推的收到时间和按GPS时间换算的时间都严格递增"""
+    assert np.all(np.diff([message["stamp"] for message in messages]) > 0)
+    clock = GpsClock()
+    assert np.all(np.diff([clock.stamp(message) for message in imu]) > 0)
+
+
+def test_corrupted_message_is_rejected():
+    parser = NovatelParser()
+    good = rawimua(0.0, [1, 2, 3, 4, 5, 6])
+    bad = bytearray(rawimua(0.005, [1, 2, 3, 4, 5, 6]))
+    bad[20] ^= 0x01
+    frame = bytearray(binary(RAWIMUB_ID, struct.pack('<Idl6l', 2107, 0.01, 0, 1, 2, 3, 4, 5, 6)))
+    frame[40] ^= 0x01
+
+    messages = parser.feed(good + bytes(bad) + bytes(frame) + good)
+
+    assert len(messages) == 2
+    assert parser.crc_errors == 2
@@ -0,0 +1,69 @@
+import numpy as np
+
+from bynav.LOAM import LEGO_cloudhandler, ScanFrame
+
+
+def rays(rings, columns):
+    """RS16的线号, 列号及各格射线方向(俯仰角-15+2*ring度, 方位角0.2*column度)"""
+    ring, column = np.meshgrid(rings, columns, indexing="ij")
+    ring, column = ring.reshape(-1), column.reshape(-1)
+    elevation, azimuth = np.radians(-15 + 2 * ring), np.radians(0.2 * column)
+    d = np.stack((np.cos(elevation) * np.cos(azimuth), np.cos(elevation) * np.sin(azimuth), np.sin(elevation)), axis=1)
+    return ring, column, d
+
+
+def scene():
+    """列0..99为z=-1.5的地面, 列200..299为x=5的墙(最下面5线), 列400为1m内的点, 列401为nan"""
+    ground = rays(range(5), range(0, 100))
+    wall = rays(range(5), range(200, 300))
+    xyz = np.concatenate((ground[2] * (-1.5 / ground[2][:, 2:]), wall[2] * (5 / wall[2][:, :1]), [[0.3, 0.1, -0.2], [np.nan] * 3]))
+    ring = np.concatenate((ground[0], wall[0], [3, 3]))
+    column = np.concatenate((ground[1], wall[1], [400, 401]))
+    return ScanFrame().load(xyz.astype(np.float32), ring, column), ground[0].shape[0]
+
+
+def test_project_and_mark_ground():
+    scan, n_ground = scene()
+    handler = LEGO_cloudhandler("RS16")
+
+    _, ground = handler.markground(scan)
+    assert ground[:n_ground].all()
+    assert not ground[n_ground:].any()
+    np.testing.assert_array_equal(handler.groundpoint, np.arange(n_ground))
+
+    handler.pointcloudproject(scan)
+    rings, columns = scan.rings.astype(int), scan.columns.astype(int)
+    distance = np.linalg.norm(scan.points[:-2], axis=1)
+    np.testing.assert_allclose(handler.rangematrix[rings[:-2], columns[:-2]], distance, rtol=1e-6)
+    np.testing.assert_array_equal(handler.index[rings[:-2] * 1800 + columns[:-2]], np.arange(len(scan) - 2))
+
+    """1m内的点和nan不投影"""
+    assert handler.rangematrix[3, 400] == 0 and handler.rangematrix[3, 401] == 0
+    assert np.count_nonzero(handler.rangematrix) == len(scan) - 2
+
+
+def test_label_components():
+    handler = LEGO_cloudhandler("RS16")
+    r = handler.rangematrix
+    wrap = np.r_[1790:1800, 0:10]
+    r[5:8, wrap] = 10.0                 #跨列0/1799的聚类, 60格
+    r[5:8, 10:30] = 30.0                #紧挨着但距离跳变, 另一个聚类
+    r[5:7, 500:505] = 8.0               #10格, 少于30
+    r[0:3, 1000:1100] = 5.0             #地面
+    r[3:5, 1000:1010] = 5.0             #与地面相连的20格, 地面不参与时单独成小聚类
+    exclude = np.zeros(r.shape, dtype=bool)
+    exclude[0:3, 1000:1100] = True
+
+    label = handler.labelcomponents(exclude)
+
+    seam = label[5:8, wrap]
+    assert (seam > 0).all() and (seam == seam[0, 0]).all()
+    far = label[5:8, 10:30]
+    assert (far > 0).all() and (far == far[0, 0]).all() and far[0, 0] != seam[0, 0]
+    assert (label[5:7, 500:505] == -1).all()
+    assert (label[3:5, 1000:1010] == -1).all()
+    assert (label[0:3, 1000:1100] == 0).all() and (label[r == 0] == 0).all()
+    assert set(np.unique(label)) == {-1, 0, 1, 2}
+
+    """地面参与时小聚类并入地面"""
+    assert (handler.labelcomponents()[3:5, 1000:1010] > 0).all()
@@ -0,0 +1,80 @@
+import numpy as np
+
+from bynav.sensor_buffer import StreamBuffer
+
+
+def filled(n, capacity=8):
+    """时间0, 1, ..., n-1, 数值为(t, 2t)"""
+    buffer = StreamBuffer(2, capacity)
+    for t in range(n):
+        assert buffer.put(float(t), (t, 2 * t))
+    return buffer
+
+
+def test_wrap_around_search_and_window():
+    buffer = filled(13)
+    stamps = np.arange(5.0, 13.0)   #环形缓冲区中为两段: 8..12在物理位置0..4, 5..7在5..7
+
+    t = np.array([-1.0, 4.5, 5.0, 6.5, 7.0, 7.5, 8.0, 11.2, 12.0, 12.5])
+    np.testing.assert_array_equal(buffer.search(t), np.searchsorted(stamps, t))
+
+    np.testing.assert_array_equal(buffer.window(6.5, 9.2)[0], [6, 7, 8, 9, 10])
+    np.testing.assert_array_equal(buffer.window(7.0, 8.0)[0], [7, 8])
+    np.testing.assert_array_equal(buffer.window(3.0, 5.5)[0], [5, 6])
+    stamp, value = buffer.window(11.5, 20.0)
+    np.testing.assert_array_equal(stamp, [11, 12])
+    np.testing.assert_array_equal(value, [[11, 22], [12, 24]])
+    assert StreamBuffer(2).window(0.0, 1.0)[0].shape == (0,)
+
+
+def test_interpolate_at_edges():
+    buffer = filled(13)
+
+    np.testing.assert_allclose(buffer.interpolate(5.0), [5, 10])
+    np.testing.assert_allclose(buffer.interpolate(12.0), [12, 24])
+    np.testing.assert_allclose(buffer.interpolate(7.25), [7.25, 14.5])     #跨两段的接缝
+    assert buffer.interpolate(4.9) is None and buffer.interpolate(12.1) is None
+
+    value = buffer.interpolate([4.0, 5.5, 12.5])
+    assert np.isnan(value[[0, 2]]).all()
+    np.testing.assert_allclose(value[1], [5.5, 11])
+
+    assert StreamBuffer(2).interpolate(1.0) is None
+    single = filled(1)
+    np.testing.assert_allclose(single.interpolate(0.0), [0, 0])
+
+
+def test_late_samples_are_dropped():
+    buffer = filled(3)
+
+    assert not buffer.put(2.0, (0, 0))
+    assert not buffer.put(1.5, (0, 0))
+    assert buffer.put(2.5, (1, 1))
+    np.testing.assert_array_equal(buffer.window(0.0, 3.0)[0], [0, 1, 2, 2.5])
+    assert buffer.late == 2
+
+
+def test_statistics():
+    stats = filled(13).statistics()
+    assert stats["count"] == 13 and stats["overwritten"] == 5 and stats["late"] == 0
+    assert stats["rate"] == 1.0
+    assert filled(1).statistics()["rate"] == 0.0
+
+
+def test_read_retries_when_writer_overwrites():
+    buffer = filled(8)
+    interpolate = buffer._interpolate
+    calls = []
+
+    def overwriting(t, count, scalar):
+        """第一次读取中途写入5个数据, 覆盖最旧的0..4"""
+        calls.append(count)
+        value = interpolate(t, count, scalar)
+        if len(calls) == 1:
+            for t_new in range(8, 13):
+                buffer.put(float(t_new), (t_new, 2 * t_new))
+        return value
+
+    buffer._interpolate = overwriting
+    assert buffer.interpolate(2.0) is None      #重读时2.0已被覆盖
+    assert calls == [8, 13] and buffer.retries == 1